@@ -0,0 +1,154 @@
+"""
+Startup benchmark for the fetch_balance cron path.
+
+Measures, for the minimal fetch settings and the full project settings:
+
+* cold-start import time of the fetch path, from `python -X importtime`
+* end-to-end wall time of `manage.py fetch_balance` against a local stub of
+  the DPDC balance API, using a cached token and a throwaway SQLite database
+
+Nothing here talks to DPDC or the configured database.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 10] [--top 15]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MANAGE = os.path.join(PROJECT_DIR, 'manage.py')
+
+SETTINGS = {
+    'fetch': None,  # manage.py picks dpdc_tracker.settings_fetch
+    'full': 'dpdc_tracker.settings',
+}
+
+
+class StubDPDCHandler(BaseHTTPRequestHandler):
+    """Answers the balance query with a balance that drops on every request"""
+    balance = 1000.0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.lock:
+            StubDPDCHandler.balance -= 1.5
+            balance = StubDPDCHandler.balance
+        body = json.dumps({'data': {'postBalanceDetails': {
+            'accountId': 'BENCH-1',
+            'customerName': 'Benchmark',
+            'balanceRemaining': balance,
+            'connectionStatus': 'Active',
+        }}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_env(workdir, port, settings_module):
+    env = dict(os.environ)
+    env.pop('DJANGO_SETTINGS_MODULE', None)
+    if settings_module:
+        env['DJANGO_SETTINGS_MODULE'] = settings_module
+    env.update({
+        'DB_ENGINE': 'sqlite3',
+        'DB_NAME': os.path.join(workdir, 'bench.sqlite3'),
+        'SPOOL_PATH': os.path.join(workdir, 'spool', 'readings.ndjson'),
+        'DPDC_THROTTLE_STATE_PATH': os.path.join(workdir, 'throttle.json'),
+        'DPDC_BASE_URL': f'http://127.0.0.1:{port}',
+        'DPDC_RATE_LIMIT': '1000',
+        'DPDC_RATE_BURST': '1000',
+    })
+    for name in ('STATE_REDIS_URL', 'PUBSUB_REDIS_URL', 'DPDC_THROTTLE_REDIS_URL'):
+        env.pop(name, None)
+    return env
+
+
+def import_times(env, workdir):
+    """
+    Return (top-level cumulative import times in microseconds, all imported
+    module names) for one fetch run
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', MANAGE, 'fetch_balance', '--customer', 'BENCH-1'],
+        cwd=workdir, env=env, capture_output=True, text=True,
+    )
+    times = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        modules.add(name.strip())
+        # Nested imports are indented; their time is included in the parent's
+        if not name.startswith('  '):
+            times[name.strip()] = int(cumulative_us)
+    return times, modules
+
+
+def timed_fetch(env, workdir):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, MANAGE, 'fetch_balance', '--customer', 'BENCH-1'],
+        cwd=workdir, env=env, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if 'Balance changed' not in result.stdout:
+        raise RuntimeError(f'fetch_balance failed:\n{result.stdout}\n{result.stderr}')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='Timed fetches per settings mode')
+    parser.add_argument('--top', type=int, default=15, help='Slowest imports to list')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubDPDCHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # fetch_balance reads the cached token from the working directory
+        with open(os.path.join(workdir, 'auth_token.txt'), 'w') as f:
+            f.write('benchmark-token')
+        subprocess.run(
+            [sys.executable, MANAGE, 'migrate', '-v', '0'],
+            cwd=workdir, env=bench_env(workdir, port, SETTINGS['full']), check=True,
+        )
+
+        for mode, settings_module in SETTINGS.items():
+            env = bench_env(workdir, port, settings_module)
+            timed_fetch(env, workdir)  # warm the OS file cache and .pyc files
+
+            times, modules = import_times(env, workdir)
+            print(f'\n== {mode} settings ==')
+            print(f'imports: {sum(times.values()) / 1000:.1f} ms across {len(times)} top-level modules')
+            for name, us in sorted(times.items(), key=lambda item: -item[1])[:args.top]:
+                print(f'  {us / 1000:8.1f} ms  {name}')
+            for heavy in ('playwright', 'rest_framework', 'django.contrib.admin'):
+                loaded = any(name == heavy or name.startswith(heavy + '.') for name in modules)
+                print(f'  {heavy} imported: {"yes" if loaded else "no"}')
+
+            runs = [timed_fetch(env, workdir) for _ in range(args.runs)]
+            print(f'fetch_balance end to end: median {statistics.median(runs) * 1000:.0f} ms, '
+                  f'min {min(runs) * 1000:.0f} ms, max {max(runs) * 1000:.0f} ms over {args.runs} runs')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
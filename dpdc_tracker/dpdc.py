@@ -2,12 +2,10 @@ import os
 import json
 import re
 import time
-import asyncio
 import logging
 import requests
 from urllib.parse import urlparse, parse_qs
-from playwright.async_api import async_playwright
-from dotenv import load_dotenv
+from throttle import get_rate_limiter, get_circuit_breaker, DEFAULT_MAX_WAIT
 
 # Setup basic logging
 logging.basicConfig(
@@ -16,14 +14,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger('dpdc_api')
 
-# Load environment variables if available
-load_dotenv()
+# Load environment variables if available. Django settings have already
+# loaded .env when this module is imported by a management command.
+if not os.getenv("DJANGO_SETTINGS_MODULE"):
+    from dotenv import load_dotenv
+    load_dotenv()
 DPDC_CUSTOMER_NUMBER = os.getenv("DPDC_CUSTOMER_NUMBER", "12345678")
 
+# Failure kinds reported through DPDCClient.last_error
+ERROR_AUTH = 'auth'                  # token rejected - a new token is needed
+ERROR_RATE_LIMITED = 'rate_limited'  # upstream asked us to slow down
+ERROR_SERVER = 'server'              # upstream 5xx
+ERROR_NETWORK = 'network'            # connection failure or timeout
+ERROR_UPSTREAM = 'upstream'          # request rejected for another reason - a new token won't help
+ERROR_CIRCUIT_OPEN = 'circuit_open'  # request not sent, upstream is cooling down
+
 class DPDCClient:
     def __init__(self, token=None, auto_extract=True):
         self.token = token
-        self.base_url = "https://amiapp.dpdc.org.bd"
+        self.last_error = None
+        self.rate_limiter = get_rate_limiter()
+        self.circuit_breaker = get_circuit_breaker()
+        self.base_url = os.getenv("DPDC_BASE_URL", "https://amiapp.dpdc.org.bd").rstrip("/")
         self.login_url = f"{self.base_url}/login"
         self.session = requests.Session()
         self.session.headers.update({
@@ -32,13 +44,18 @@ class DPDCClient:
             "Accept-Language": "en-US,en;q=0.9",
             "Connection": "keep-alive",
             "tenantCode": "DPDC",
-            "Origin": "https://amiapp.dpdc.org.bd",
-            "Referer": "https://amiapp.dpdc.org.bd/quick-pay"
+            "Origin": self.base_url,
+            "Referer": f"{self.base_url}/quick-pay"
         })
         
         # If token is provided, update headers
         if self.token:
             self._update_auth_headers()
+
+    @property
+    def needs_new_token(self):
+        """True if the last balance request failed because the token was rejected"""
+        return self.last_error == ERROR_AUTH
             
     def _update_auth_headers(self):
         """Update session headers with authentication token"""
@@ -114,6 +131,9 @@ class DPDCClient:
     
     async def extract_token(self):
         """Extract the auth token by visiting the site with Playwright"""
+        # Imported here so runs with a cached token never load Playwright
+        import asyncio
+        from playwright.async_api import async_playwright
         logger.info("Attempting to extract authentication token using Playwright...")
         token = None
         
@@ -180,13 +200,54 @@ class DPDCClient:
         
         return token
             
+    def _record_failure(self, kind, response=None):
+        """Remember why a request failed and feed upstream failures to the governor"""
+        self.last_error = kind
+        if kind == ERROR_RATE_LIMITED:
+            retry_after = None
+            if response is not None:
+                try:
+                    retry_after = float(response.headers.get('Retry-After', ''))
+                except ValueError:
+                    pass
+            self.rate_limiter.on_throttled(retry_after)
+            self.circuit_breaker.record_failure()
+        elif kind in (ERROR_SERVER, ERROR_NETWORK):
+            self.circuit_breaker.record_failure()
+        elif kind in (ERROR_AUTH, ERROR_UPSTREAM):
+            # The upstream answered, so it is healthy
+            self.circuit_breaker.record_success()
+
+    @staticmethod
+    def _is_rate_limit_error(errors):
+        text = json.dumps(errors).lower()
+        return any(marker in text for marker in ('rate limit', 'too many', 'throttl'))
+
+    @staticmethod
+    def _is_auth_error(errors):
+        text = json.dumps(errors).lower()
+        return any(marker in text for marker in ('token', 'auth', 'jwt', 'expired'))
+
     def get_balance(self, customer_number=None, retry_on_error=True):
         """Get balance information using the token"""
+        self.last_error = None
         if not customer_number:
             customer_number = DPDC_CUSTOMER_NUMBER
 
         if not self.token:
             logger.error("No token available")
+            self.last_error = ERROR_AUTH
+            return None
+
+        if not self.circuit_breaker.allow_request():
+            logger.warning("Circuit breaker is open - upstream is cooling down, skipping request")
+            self.last_error = ERROR_CIRCUIT_OPEN
+            return None
+
+        max_wait = float(os.getenv('DPDC_RATE_MAX_WAIT', DEFAULT_MAX_WAIT))
+        if not self.rate_limiter.acquire(max_wait):
+            logger.warning("Rate limiter budget exhausted - skipping request")
+            self.last_error = ERROR_RATE_LIMITED
             return None
 
         url = f"{self.base_url}/usage/usage-service"
@@ -200,32 +261,52 @@ class DPDCClient:
         try:
             logger.info("Making balance API request...")
             response = self.session.post(url, json=payload)
+        except Exception as e:
+            logger.error(f"Error making API request: {e}")
+            self._record_failure(ERROR_NETWORK)
+            return None
 
+        try:
             if response.status_code == 200:
                 result = response.json()
-                if "data" in result and "postBalanceDetails" in result["data"]:
+                if "data" in result and result["data"] and result["data"].get("postBalanceDetails"):
                     balance_info = result["data"]["postBalanceDetails"]
                     logger.info(f"Balance: {balance_info['balanceRemaining']}")
+                    self.rate_limiter.on_success()
+                    self.circuit_breaker.record_success()
                     return balance_info
-                elif "errors" in result and retry_on_error:
+                if "errors" in result:
                     logger.error("API returned errors but status code was 200")
                     logger.error(f"Errors: {result['errors']}")
+                    if self._is_rate_limit_error(result['errors']):
+                        self._record_failure(ERROR_RATE_LIMITED, response)
+                    elif self._is_auth_error(result['errors']):
+                        self._record_failure(ERROR_AUTH)
+                    else:
+                        self._record_failure(ERROR_UPSTREAM)
                     return None
+        except ValueError as e:
+            logger.error(f"Invalid JSON in API response: {e}")
+            self._record_failure(ERROR_SERVER)
+            return None
 
+        logger.error(f"API request failed: {response.status_code}")
+        logger.error(f"Response: {response.text}")
+        if response.status_code == 429:
+            logger.warning("Upstream is rate limiting requests. Backing off.")
+            self._record_failure(ERROR_RATE_LIMITED, response)
+        elif response.status_code >= 500 or response.status_code == 408:
+            logger.warning("Upstream server error. Not refreshing the token.")
+            self._record_failure(ERROR_SERVER)
+        elif response.status_code in (401, 403):
             # Handle error - token might be expired
             if retry_on_error:
-                logger.error(f"API request failed: {response.status_code}")
-                logger.error(f"Response: {response.text}")
                 logger.warning("Token might be expired. Will try to get a new token.")
-                return None
-            else:
-                logger.error(f"API request failed: {response.status_code}")
-                logger.error(f"Response: {response.text}")
-                return None
-
-        except Exception as e:
-            logger.error(f"Error making API request: {e}")
-            return None
+            self._record_failure(ERROR_AUTH)
+        else:
+            logger.warning("Upstream rejected the request. Not refreshing the token.")
+            self._record_failure(ERROR_UPSTREAM)
+        return None
 
 async def main():
     """Main function to run the DPDC client"""
@@ -247,6 +328,9 @@ async def main():
         balance_info = dpdc.get_balance(retry_on_error=False)
         
         # If balance check fails, the token might be expired
+        if not balance_info and not dpdc.needs_new_token:
+            logger.error("Balance request failed for a reason a new token cannot fix")
+            return None
         if not balance_info:
             logger.warning("Failed to get balance with saved token. Token might be expired.")
             logger.info("Will extract a new token...")
@@ -274,7 +358,7 @@ async def main():
     balance_info = dpdc.get_balance()
     
     # If still failing after token refresh, try one more time with a fresh token
-    if not balance_info and not token_refreshed:
+    if not balance_info and not token_refreshed and dpdc.needs_new_token:
         logger.warning("Still failing with existing token. Will force a new token extraction.")
         # Force a new token extraction
         token = await dpdc.extract_token()
@@ -308,6 +392,11 @@ async def main():
         print("Failed to get balance information")
         return None
 
+def refresh_token(dpdc):
+    """Run the browser token extraction from synchronous code"""
+    import asyncio
+    return asyncio.run(dpdc.extract_token())
+
 def check_balance_for_customer(customer_number):
     """Simple function to check balance for a specific customer"""
     try:
@@ -322,7 +411,7 @@ def check_balance_for_customer(customer_number):
         # Get a new token automatically if needed
         if not token:
             dpdc = DPDCClient()
-            token = asyncio.run(dpdc.extract_token())
+            token = refresh_token(dpdc)
             if not token:
                 return None
         
@@ -330,10 +419,11 @@ def check_balance_for_customer(customer_number):
         dpdc = DPDCClient(token=token)
         balance_info = dpdc.get_balance(customer_number, retry_on_error=False)
         
-        # If request fails, try to get a new token
-        if not balance_info:
+        # If the token was rejected, try to get a new one. Rate limiting and
+        # upstream errors are not fixed by a new token, so don't launch a browser.
+        if not balance_info and dpdc.needs_new_token:
             logger.warning("Token might be expired. Getting a new one...")
-            token = asyncio.run(dpdc.extract_token())
+            token = refresh_token(dpdc)
             if token:
                 dpdc = DPDCClient(token=token)
                 balance_info = dpdc.get_balance(customer_number, retry_on_error=False)
@@ -351,4 +441,5 @@ def check_balance_for_customer(customer_number):
         return None
 
 if __name__ == "__main__":
+    import asyncio
     asyncio.run(main())
\ No newline at end of file
@@ -61,15 +61,37 @@ WSGI_APPLICATION = 'dpdc_tracker.wsgi.application'
 # Database
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': f"django.db.backends.{os.getenv('DB_ENGINE', 'postgresql')}",
         'NAME': os.getenv('DB_NAME', 'dpdc_tracker'),
         'USER': os.getenv('DB_USER', 'dpdc_user'),
         'PASSWORD': os.getenv('DB_PASSWORD', 'yourpassword'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        # Reuse connections across requests instead of reconnecting every time,
+        # and check a reused connection is still alive before handing it out
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Optional read replica for the analytics views (any setting not given is
+# taken from the primary, so DB_REPLICA_HOST alone is usually enough)
+if os.getenv('DB_REPLICA_NAME') or os.getenv('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'USER': os.getenv('DB_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.getenv('DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'HOST': os.getenv('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['electricity_tracker.routers.AnalyticsRouter']
+
+# Alias the read-only analytics views read from
+ANALYTICS_DB_ALIAS = os.getenv('ANALYTICS_DB_ALIAS', 'replica' if 'replica' in DATABASES else 'default')
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -99,6 +121,36 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Write-ahead spool for fetched readings
+SPOOL_PATH = os.getenv('SPOOL_PATH', os.path.join(BASE_DIR, 'spool', 'readings.ndjson'))
+SPOOL_BATCH_SIZE = int(os.getenv('SPOOL_BATCH_SIZE', '500'))
+
+# Retention: raw entries older than this are compacted into daily rollups
+RETENTION_RAW_DAYS = int(os.getenv('RETENTION_RAW_DAYS', '90'))
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+
+# Live balance stream (stream/). Set PUBSUB_REDIS_URL so readings ingested by
+# other processes, such as the fetch_balance cron job, reach subscribers.
+PUBSUB_REDIS_URL = os.getenv('PUBSUB_REDIS_URL')
+SSE_HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_MAX_SECONDS = int(os.getenv('SSE_MAX_SECONDS', '3600'))
+
+# Current state store (latest reading and running totals per account).
+# Without Redis each process caches state for STATE_LOCAL_TTL_SECONDS and
+# then re-reads it from the database. Warming (STATE_WARM_ON_STARTUP and
+# warm_state), and with it the running totals on latest/, needs Redis.
+STATE_REDIS_URL = os.getenv('STATE_REDIS_URL')
+STATE_CACHE_SIZE = int(os.getenv('STATE_CACHE_SIZE', '10000'))
+STATE_LOCAL_TTL_SECONDS = float(os.getenv('STATE_LOCAL_TTL_SECONDS', '5'))
+STATE_WARM_ON_STARTUP = os.getenv('STATE_WARM_ON_STARTUP', 'True') == 'True'
+
+# Balance increases of at least this many Taka are treated as recharges
+RECHARGE_MIN_AMOUNT = float(os.getenv('RECHARGE_MIN_AMOUNT', '50'))
+
+# Streaming anomaly detection on ingested readings
+ANOMALY_Z_THRESHOLD = float(os.getenv('ANOMALY_Z_THRESHOLD', '5'))
+ANOMALY_WARMUP_READINGS = int(os.getenv('ANOMALY_WARMUP_READINGS', '24'))
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -0,0 +1,17 @@
+"""
+Minimal settings for the fetch_balance and flush_spool cron commands.
+
+Only the electricity_tracker app is loaded: no admin, auth, sessions or REST
+framework, which these commands never use, so each run starts faster.
+manage.py selects this module for those commands unless
+DJANGO_SETTINGS_MODULE is already set.
+"""
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'electricity_tracker',
+]
+
+MIDDLEWARE = []
+
+TEMPLATES = []
@@ -0,0 +1,29 @@
+"""
+Settings for running the test suite locally without PostgreSQL or Redis:
+
+    python manage.py test --settings=dpdc_tracker.settings_test
+
+A primary and a replica SQLite database exercise the analytics router. The
+tests run against in-memory copies; the database files themselves live in
+the temp directory so nothing is left behind in the project.
+"""
+import os
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.gettempdir(), 'dpdc_tracker_test_default.sqlite3'),
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.gettempdir(), 'dpdc_tracker_test_replica.sqlite3'),
+    },
+}
+ANALYTICS_DB_ALIAS = 'replica'
+
+STATE_REDIS_URL = None
+PUBSUB_REDIS_URL = None
+STATE_WARM_ON_STARTUP = False
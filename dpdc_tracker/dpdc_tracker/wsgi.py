@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dpdc_tracker.settings')
 
 application = get_wsgi_application()
+
+# Load latest balances into the current state store before the first request
+from electricity_tracker.state import warm_on_startup  # noqa: E402
+warm_on_startup()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import BalanceEntry
+from .models import BalanceEntry, DailyUsageRollup, Anomaly, RechargeEvent
 
 @admin.register(BalanceEntry)
 class BalanceEntryAdmin(admin.ModelAdmin):
@@ -7,4 +7,25 @@ class BalanceEntryAdmin(admin.ModelAdmin):
     list_filter = ('status', 'timestamp')
     search_fields = ('customer_name', 'account_id')
     date_hierarchy = 'timestamp'
-    readonly_fields = ('hourly_usage', 'original_balance')
\ No newline at end of file
+    readonly_fields = ('hourly_usage', 'original_balance')
+
+@admin.register(DailyUsageRollup)
+class DailyUsageRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'account_id', 'total_usage', 'avg_balance', 'entry_count')
+    search_fields = ('account_id',)
+    date_hierarchy = 'date'
+
+
+@admin.register(Anomaly)
+class AnomalyAdmin(admin.ModelAdmin):
+    list_display = ('timestamp', 'account_id', 'kind', 'value', 'expected', 'score')
+    list_filter = ('kind', 'timestamp')
+    search_fields = ('account_id',)
+    date_hierarchy = 'timestamp'
+
+
+@admin.register(RechargeEvent)
+class RechargeEventAdmin(admin.ModelAdmin):
+    list_display = ('timestamp', 'account_id', 'amount', 'balance_before', 'balance_after')
+    search_fields = ('account_id',)
+    date_hierarchy = 'timestamp'
@@ -0,0 +1,140 @@
+"""
+Streaming anomaly detection on ingested readings.
+
+Each account keeps O(1) rolling statistics of its usage rate (Tk per hour):
+Welford mean and variance and a stochastic-approximation median and MAD.
+The median and MAD are seeded from the exact values of the warm-up readings,
+and the score's scale is floored by the Welford standard deviation, so
+detection does not start with an underestimated spread. A reading is flagged
+when
+
+* its usage rate is far above the robust (median/MAD) norm (usage_spike),
+* the balance drops to zero far faster than usual (meter_reset), or
+* the balance rises by less than RECHARGE_MIN_AMOUNT, too little to be a
+  recharge (balance_jump).
+"""
+import math
+import logging
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Anomaly, AnomalyDetectorState
+
+logger = logging.getLogger('anomaly')
+
+MEDIAN_STEP = 0.05   # step size of the streaming median/MAD, relative to the current MAD
+MAD_SCALE = 1.4826   # MAD to standard deviation for normally distributed data
+MAX_GAP_HOURS = 24   # readings further apart than this don't give a usable rate
+
+
+def _median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def _observe(state, rate):
+    """Fold a usage rate into the rolling statistics"""
+    # Welford
+    state['n'] += 1
+    delta = rate - state['mean']
+    state['mean'] += delta / state['n']
+    state['m2'] += delta * (rate - state['mean'])
+
+    # Exact median and MAD of the warm-up readings seed the streaming estimates
+    warmup = state.setdefault('warmup', [])
+    if state['n'] <= max(settings.ANOMALY_WARMUP_READINGS, 1):
+        warmup.append(rate)
+        state['median'] = _median(warmup)
+        state['mad'] = _median([abs(value - state['median']) for value in warmup])
+        if state['n'] == max(settings.ANOMALY_WARMUP_READINGS, 1):
+            state['warmup'] = []
+        return
+
+    # Streaming median and MAD
+    step = MEDIAN_STEP * max(state['mad'], abs(state['median']) * 0.1, 1e-3)
+    state['median'] += step if rate > state['median'] else -step if rate < state['median'] else 0
+    deviation = abs(rate - state['median'])
+    state['mad'] += step if deviation > state['mad'] else -step if deviation < state['mad'] else 0
+    state['mad'] = max(state['mad'], 0.0)
+
+
+def robust_score(state, rate):
+    """Robust z-score of a rate against the account's median and MAD"""
+    std = math.sqrt(state['m2'] / (state['n'] - 1)) if state['n'] > 1 else 0.0
+    scale = max(MAD_SCALE * state['mad'], std)
+    if scale <= 0:
+        return 0.0
+    return (rate - state['median']) / scale
+
+
+def new_state():
+    return {'n': 0, 'mean': 0.0, 'm2': 0.0, 'median': 0.0, 'mad': 0.0, 'warmup': [],
+            'last_balance': None, 'last_timestamp': None}
+
+
+def detect(state, balance, timestamp):
+    """
+    Update an account's state with one reading and return the anomalies it shows.
+
+    Returns a list of dicts with kind, value, expected and score. Readings
+    at or before the last one seen are skipped and leave the state untouched.
+    """
+    anomalies = []
+    last_balance = state['last_balance']
+    last_timestamp = datetime.fromisoformat(state['last_timestamp']) if state['last_timestamp'] else None
+    if last_timestamp is not None and timestamp <= last_timestamp:
+        return anomalies
+    state['last_balance'] = balance
+    state['last_timestamp'] = timestamp.isoformat()
+    if last_balance is None:
+        return anomalies
+
+    change = balance - last_balance
+    if change > 0:
+        if change < settings.RECHARGE_MIN_AMOUNT:
+            anomalies.append({'kind': Anomaly.BALANCE_JUMP, 'value': change, 'expected': None, 'score': None})
+        return anomalies
+
+    hours = (timestamp - last_timestamp).total_seconds() / 3600
+    if hours > MAX_GAP_HOURS:
+        return anomalies
+    rate = -change / hours
+
+    if state['n'] >= settings.ANOMALY_WARMUP_READINGS:
+        score = robust_score(state, rate)
+        if score > settings.ANOMALY_Z_THRESHOLD:
+            kind = Anomaly.METER_RESET if balance <= 0 < last_balance else Anomaly.USAGE_SPIKE
+            anomalies.append({'kind': kind, 'value': rate, 'expected': state['median'], 'score': score})
+    _observe(state, rate)
+    return anomalies
+
+
+def _anomaly(account_id, timestamp, balance, found, entry_id=None):
+    return Anomaly(account_id=account_id, timestamp=timestamp, balance=balance, entry_id=entry_id, **found)
+
+
+def detect_anomalies(sender, entries, **kwargs):
+    """readings_stored receiver running new entries through the detector"""
+    by_account = {}
+    for entry in entries:
+        if entry.account_id:
+            by_account.setdefault(entry.account_id, []).append(entry)
+
+    for account_id, account_entries in by_account.items():
+        with transaction.atomic():
+            detector, _ = AnomalyDetectorState.objects.select_for_update().get_or_create(
+                account_id=account_id, defaults={'state': new_state()}
+            )
+            anomalies = []
+            for entry in sorted(account_entries, key=lambda e: e.timestamp):
+                for found in detect(detector.state, entry.balance, entry.timestamp):
+                    anomalies.append(_anomaly(account_id, entry.timestamp, entry.balance, found, entry.pk))
+            detector.save()
+            Anomaly.objects.bulk_create(anomalies, ignore_conflicts=True)
+        for anomaly in anomalies:
+            logger.warning(f"Anomaly for {account_id}: {anomaly.get_kind_display()} at {anomaly.timestamp} (value {anomaly.value:.2f})")
@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class ElectricityTrackerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'electricity_tracker'
+
+    def ready(self):
+        from .signals import readings_ingested, readings_stored
+        from .pubsub import publish_entries
+        from .state import update_current_state
+        from .load_profile import update_load_profiles
+        from .anomaly import detect_anomalies
+        from .recharges import record_recharges
+        # State first, so stream subscribers reading latest/ see the new entry
+        readings_ingested.connect(update_current_state, dispatch_uid='update_current_state')
+        readings_ingested.connect(publish_entries, dispatch_uid='publish_entries')
+        readings_stored.connect(update_load_profiles, dispatch_uid='update_load_profiles')
+        readings_stored.connect(detect_anomalies, dispatch_uid='detect_anomalies')
+        readings_stored.connect(record_recharges, dispatch_uid='record_recharges')
@@ -0,0 +1,90 @@
+"""
+Compressed, date-partitioned archive of compacted balance entries.
+
+Entries for a local day are stored under ARCHIVE_DIR/YYYY/MM/ as one or more
+balance-YYYY-MM-DD.<chunk>.ndjson.gz files. Each chunk file is written to a
+temporary name and renamed into place, so readers never see a partial file.
+An interrupted compaction may archive the same entry twice; readers
+de-duplicate by id.
+"""
+import os
+import gzip
+import json
+import uuid
+from datetime import date, datetime
+
+from django.conf import settings
+
+ARCHIVE_FIELDS = [
+    'id', 'timestamp', 'balance', 'hourly_usage', 'original_balance',
+    'account_id', 'customer_name', 'status',
+]
+
+
+def archive_dir(day, root=None):
+    """Directory holding archive chunks for a local date"""
+    root = str(root or settings.ARCHIVE_DIR)
+    return os.path.join(root, f"{day:%Y}", f"{day:%m}")
+
+
+def write_archive(day, rows, root=None):
+    """Durably write entry rows (dicts of ARCHIVE_FIELDS) as a new chunk of the day's archive"""
+    directory = archive_dir(day, root)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"balance-{day:%Y-%m-%d}.{uuid.uuid4().hex[:12]}.ndjson.gz")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            for row in rows:
+                record = {field: row.get(field) for field in ARCHIVE_FIELDS}
+                record['id'] = str(record['id'])
+                record['timestamp'] = record['timestamp'].isoformat()
+                f.write((json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return path
+
+
+def archived_days(start=None, end=None, root=None):
+    """Yield (date, [paths]) for archived local dates within [start, end], oldest first"""
+    root = str(root or settings.ARCHIVE_DIR)
+    days = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if not (filename.startswith('balance-') and filename.endswith('.ndjson.gz')):
+                continue
+            try:
+                day = date.fromisoformat(filename[len('balance-'):len('balance-YYYY-MM-DD')])
+            except ValueError:
+                continue
+            if (start and day < start) or (end and day > end):
+                continue
+            days.setdefault(day, []).append(os.path.join(dirpath, filename))
+    for day in sorted(days):
+        yield day, sorted(days[day])
+
+
+def iter_archived_entries(start=None, end=None, account_id=None, root=None):
+    """
+    Yield archived entries as dicts for local dates within [start, end].
+
+    Entries are yielded in timestamp order within each day and each entry
+    is yielded once even if it was archived more than once.
+    """
+    for _, paths in archived_days(start, end, root):
+        entries = {}
+        for path in paths:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    if account_id and record.get('account_id') != account_id:
+                        continue
+                    record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+                    entries[record['id']] = record
+        yield from sorted(entries.values(), key=lambda r: r['timestamp'])
@@ -0,0 +1,123 @@
+"""
+Hour-of-week load profiles.
+
+Every reading with usage is added to one of 168 local hour-of-week buckets
+of its account: a count, a sum and a fixed log-spaced histogram that
+percentile bands are estimated from. The buckets are updated incrementally
+on ingest, so a profile is answered from one row regardless of history size.
+"""
+import math
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import LoadProfile
+
+logger = logging.getLogger('load_profile')
+
+HOURS_PER_WEEK = 7 * 24
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+# Histogram bin 0 holds usage below BIN_MIN; bin i >= 1 holds
+# [BIN_MIN * BIN_RATIO**(i-1), BIN_MIN * BIN_RATIO**i), the last bin is open-ended
+BIN_COUNT = 32
+BIN_MIN = 0.05
+BIN_RATIO = 1.35
+
+
+def hour_of_week(timestamp):
+    """Local (Asia/Dhaka) hour of the week, Monday 00:00 being 0"""
+    local = timezone.localtime(timestamp)
+    return local.weekday() * 24 + local.hour
+
+
+def bin_index(value):
+    if value < BIN_MIN:
+        return 0
+    return min(BIN_COUNT - 1, 1 + int(math.log(value / BIN_MIN, BIN_RATIO)))
+
+
+def bin_bounds(index):
+    if index == 0:
+        return 0.0, BIN_MIN
+    lower = BIN_MIN * BIN_RATIO ** (index - 1)
+    return lower, lower * BIN_RATIO
+
+
+def quantile(histogram, q):
+    """Estimate the q-quantile of a histogram by interpolating inside its bin"""
+    total = sum(histogram)
+    if not total:
+        return None
+    target = q * total
+    cumulative = 0
+    for index, count in enumerate(histogram):
+        if count and cumulative + count >= target:
+            lower, upper = bin_bounds(index)
+            return lower + (upper - lower) * (target - cumulative) / count
+        cumulative += count
+    return bin_bounds(BIN_COUNT - 1)[1]
+
+
+def empty_buckets():
+    return {
+        'counts': [0] * HOURS_PER_WEEK,
+        'sums': [0.0] * HOURS_PER_WEEK,
+        'histograms': [[0] * BIN_COUNT for _ in range(HOURS_PER_WEEK)],
+    }
+
+
+def add_reading(buckets, timestamp, usage):
+    """Add one reading's usage to a buckets dict; readings without usage are ignored"""
+    if not usage or usage <= 0:
+        return
+    slot = hour_of_week(timestamp)
+    buckets['counts'][slot] += 1
+    buckets['sums'][slot] += usage
+    buckets['histograms'][slot][bin_index(usage)] += 1
+
+
+def save_buckets(account_id, buckets):
+    LoadProfile.objects.update_or_create(account_id=account_id, defaults=buckets)
+
+
+def update_load_profiles(sender, entries, **kwargs):
+    """readings_stored receiver adding new entries to their accounts' profiles"""
+    by_account = {}
+    for entry in entries:
+        if entry.account_id and entry.hourly_usage > 0:
+            by_account.setdefault(entry.account_id, []).append(entry)
+
+    for account_id, account_entries in by_account.items():
+        with transaction.atomic():
+            profile, _ = LoadProfile.objects.select_for_update().get_or_create(
+                account_id=account_id, defaults=empty_buckets()
+            )
+            buckets = {'counts': profile.counts, 'sums': profile.sums, 'histograms': profile.histograms}
+            for entry in account_entries:
+                add_reading(buckets, entry.timestamp, entry.hourly_usage)
+            profile.save()
+
+
+def profile_summary(profile, quantiles=(0.1, 0.5, 0.9)):
+    """7x24 heatmap of mean usage, reading counts and percentile bands"""
+    def by_day(values):
+        return [values[day * 24:(day + 1) * 24] for day in range(7)]
+
+    means = [
+        profile.sums[slot] / profile.counts[slot] if profile.counts[slot] else None
+        for slot in range(HOURS_PER_WEEK)
+    ]
+    bands = {
+        f"p{round(q * 100)}": by_day([quantile(histogram, q) for histogram in profile.histograms])
+        for q in quantiles
+    }
+    return {
+        'account_id': profile.account_id,
+        'updated_at': profile.updated_at,
+        'weekdays': WEEKDAYS,
+        'mean_usage': by_day(means),
+        'counts': by_day(profile.counts),
+        'bands': bands,
+    }
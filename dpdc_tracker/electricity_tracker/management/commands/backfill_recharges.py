@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from electricity_tracker.models import BalanceEntry, RechargeEvent
+from electricity_tracker.archive import iter_archived_entries
+from electricity_tracker.recharges import recharge_between
+
+class Command(BaseCommand):
+    help = 'Detects recharge events in stored and archived balance history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--account',
+            type=str,
+            help='Only backfill this account ID',
+        )
+        parser.add_argument(
+            '--skip-archive',
+            action='store_true',
+            help='Ignore entries compacted into the archive',
+        )
+
+    def handle(self, *args, **options):
+        account_id = options.get('account')
+        previous = {}
+        events = []
+        seen = set()
+
+        def scan(account, timestamp, balance, entry_id):
+            if not account:
+                return
+            event = recharge_between(account, previous.get(account), balance, timestamp, entry_id)
+            if event:
+                events.append(event)
+            previous[account] = balance
+
+        if not options.get('skip_archive'):
+            for record in iter_archived_entries(account_id=account_id):
+                seen.add(record['id'])
+                scan(record['account_id'], record['timestamp'], record['balance'], None)
+
+        entries = BalanceEntry.objects.order_by('timestamp')
+        if account_id:
+            entries = entries.filter(account_id=account_id)
+        for pk, account, timestamp, balance in entries.values_list('id', 'account_id', 'timestamp', 'balance').iterator(chunk_size=5000):
+            if str(pk) not in seen:
+                scan(account, timestamp, balance, pk)
+
+        # Existing events are kept; the unique constraint skips duplicates
+        RechargeEvent.objects.bulk_create(events, batch_size=1000, ignore_conflicts=True)
+        self.stdout.write(self.style.SUCCESS(
+            f'Found {len(events)} recharges across {len(previous)} accounts'
+        ))
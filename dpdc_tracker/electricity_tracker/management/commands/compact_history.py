@@ -0,0 +1,120 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from electricity_tracker.models import BalanceEntry, DailyUsageRollup
+from electricity_tracker.archive import ARCHIVE_FIELDS, write_archive
+from datetime import datetime, time, timedelta
+import logging
+
+class Command(BaseCommand):
+    help = 'Compacts old balance entries into daily rollups and archives the raw rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--raw-days',
+            type=int,
+            default=settings.RETENTION_RAW_DAYS,
+            help='Keep raw entries for this many days (default: RETENTION_RAW_DAYS)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Entries archived and deleted per transaction',
+        )
+        parser.add_argument(
+            '--archive-dir',
+            type=str,
+            help='Directory for compressed archives (default: ARCHIVE_DIR)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would be compacted without changing anything',
+        )
+
+    def handle(self, *args, **options):
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
+        logger = logging.getLogger('compact_history')
+
+        raw_days = options['raw_days']
+        if raw_days < 1:
+            self.stderr.write(self.style.ERROR('--raw-days must be at least 1'))
+            return None
+
+        # Only compact whole local days
+        tz = timezone.get_current_timezone()
+        cutoff_date = timezone.localdate() - timedelta(days=raw_days)
+        cutoff = datetime.combine(cutoff_date, time.min, tzinfo=tz)
+        old_entries = BalanceEntry.objects.filter(timestamp__lt=cutoff)
+
+        if options['dry_run']:
+            count = old_entries.count()
+            self.stdout.write(f'{count} entries older than {cutoff_date} would be compacted')
+            return None
+
+        total = 0
+        days = 0
+        while True:
+            oldest = old_entries.order_by('timestamp').values_list('timestamp', flat=True).first()
+            if oldest is None:
+                break
+            day = timezone.localtime(oldest, tz).date()
+            day_start = datetime.combine(day, time.min, tzinfo=tz)
+            day_end = datetime.combine(day + timedelta(days=1), time.min, tzinfo=tz)
+            compacted = self.compact_day(day, day_start, min(day_end, cutoff), options)
+            logger.info(f"Compacted {compacted} entries for {day}")
+            total += compacted
+            days += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Compacted {total} entries across {days} days older than {cutoff_date}'))
+        return None
+
+    def compact_day(self, day, start, end, options):
+        """Archive, roll up and delete a day's entries one chunk per transaction"""
+        compacted = 0
+        day_entries = BalanceEntry.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        while True:
+            with transaction.atomic():
+                ids = list(day_entries.order_by('timestamp', 'id').values_list('id', flat=True)[:options['chunk_size']])
+                if not ids:
+                    return compacted
+                rows = list(
+                    BalanceEntry.objects.select_for_update().filter(pk__in=ids)
+                    .order_by('timestamp').values(*ARCHIVE_FIELDS)
+                )
+                # The archive is written before the rows go; an interrupted run
+                # rolls back and archives the same rows again, which readers tolerate
+                write_archive(day, rows, options.get('archive_dir'))
+                self.fold_into_rollups(day, rows)
+                BalanceEntry.objects.filter(pk__in=ids).delete()
+            compacted += len(rows)
+
+    def fold_into_rollups(self, day, rows):
+        """Merge a chunk of entries into the day's rollup for each account"""
+        by_account = {}
+        for row in rows:
+            by_account.setdefault(row['account_id'], []).append(row)
+
+        for account_id, account_rows in by_account.items():
+            rollup, _ = DailyUsageRollup.objects.select_for_update().get_or_create(account_id=account_id, date=day)
+            balances = [row['balance'] for row in account_rows]
+            count = rollup.entry_count + len(account_rows)
+
+            rollup.total_usage += sum(row['hourly_usage'] for row in account_rows)
+            rollup.avg_balance = (rollup.avg_balance * rollup.entry_count + sum(balances)) / count
+            rollup.min_balance = min(balances + ([rollup.min_balance] if rollup.min_balance is not None else []))
+            rollup.max_balance = max(balances + ([rollup.max_balance] if rollup.max_balance is not None else []))
+            rollup.entry_count = count
+
+            first, last = account_rows[0], account_rows[-1]
+            if rollup.first_timestamp is None or first['timestamp'] < rollup.first_timestamp:
+                rollup.first_timestamp = first['timestamp']
+            if rollup.last_timestamp is None or last['timestamp'] >= rollup.last_timestamp:
+                rollup.last_timestamp = last['timestamp']
+                rollup.last_balance = last['balance']
+            rollup.save()
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from electricity_tracker.models import Anomaly, AnomalyDetectorState, BalanceEntry
+from electricity_tracker.archive import iter_archived_entries
+from electricity_tracker.anomaly import detect, new_state
+
+class Command(BaseCommand):
+    help = 'Replays stored balance history through the anomaly detector'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--replay',
+            action='store_true',
+            help='Reset detector state and anomalies, then replay history (required)',
+        )
+        parser.add_argument(
+            '--account',
+            type=str,
+            help='Only replay this account ID',
+        )
+        parser.add_argument(
+            '--skip-archive',
+            action='store_true',
+            help='Ignore entries compacted into the archive',
+        )
+
+    def handle(self, *args, **options):
+        if not options.get('replay'):
+            raise CommandError('Live detection runs on ingest; pass --replay to rebuild from history')
+        account_id = options.get('account')
+
+        states = {}
+        anomalies = []
+        seen = set()
+
+        def replay(account, timestamp, balance, entry_id):
+            if not account:
+                return
+            state = states.setdefault(account, new_state())
+            for found in detect(state, balance, timestamp):
+                anomalies.append(Anomaly(
+                    account_id=account, timestamp=timestamp, balance=balance, entry_id=entry_id, **found
+                ))
+
+        if not options.get('skip_archive'):
+            for record in iter_archived_entries(account_id=account_id):
+                seen.add(record['id'])
+                replay(record['account_id'], record['timestamp'], record['balance'], None)
+
+        entries = BalanceEntry.objects.order_by('timestamp')
+        if account_id:
+            entries = entries.filter(account_id=account_id)
+        for pk, account, timestamp, balance in entries.values_list('id', 'account_id', 'timestamp', 'balance').iterator(chunk_size=5000):
+            if str(pk) not in seen:
+                replay(account, timestamp, balance, pk)
+
+        with transaction.atomic():
+            old_anomalies = Anomaly.objects.all()
+            old_states = AnomalyDetectorState.objects.all()
+            if account_id:
+                old_anomalies = old_anomalies.filter(account_id=account_id)
+                old_states = old_states.filter(account_id=account_id)
+            old_anomalies.delete()
+            old_states.delete()
+            AnomalyDetectorState.objects.bulk_create(
+                [AnomalyDetectorState(account_id=account, state=state) for account, state in states.items()]
+            )
+            Anomaly.objects.bulk_create(anomalies, batch_size=1000, ignore_conflicts=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Replayed {len(states)} accounts and found {len(anomalies)} anomalies'
+        ))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from electricity_tracker.models import BalanceEntry
+from electricity_tracker.archive import ARCHIVE_FIELDS, iter_archived_entries
+from datetime import date, datetime, time, timedelta
+import csv
+
+class Command(BaseCommand):
+    help = 'Exports balance entries as CSV, including entries compacted into the archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=str, help='First local date to export (YYYY-MM-DD)')
+        parser.add_argument('--end', type=str, help='Last local date to export (YYYY-MM-DD)')
+        parser.add_argument('--account', type=str, help='Only export entries for this account ID')
+        parser.add_argument('--output', type=str, help='Write to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start']) if options.get('start') else None
+            end = date.fromisoformat(options['end']) if options.get('end') else None
+        except ValueError:
+            raise CommandError('Dates must be in YYYY-MM-DD format')
+
+        entries = BalanceEntry.objects.order_by('timestamp')
+        tz = timezone.get_current_timezone()
+        if start:
+            entries = entries.filter(timestamp__gte=datetime.combine(start, time.min, tzinfo=tz))
+        if end:
+            entries = entries.filter(timestamp__lt=datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz))
+        if options.get('account'):
+            entries = entries.filter(account_id=options['account'])
+
+        output = open(options['output'], 'w', newline='') if options.get('output') else self.stdout
+        try:
+            writer = csv.DictWriter(output, fieldnames=ARCHIVE_FIELDS)
+            writer.writeheader()
+            seen = set()
+            # Archived days are older than anything still in the table
+            for record in iter_archived_entries(start, end, options.get('account')):
+                seen.add(record['id'])
+                writer.writerow(record)
+            for record in entries.values(*ARCHIVE_FIELDS).iterator(chunk_size=2000):
+                record['id'] = str(record['id'])
+                if record['id'] not in seen:
+                    writer.writerow(record)
+        finally:
+            if output is not self.stdout:
+                output.close()
@@ -1,23 +1,15 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from electricity_tracker.models import BalanceEntry
+from electricity_tracker.spool import ReadingSpool, flush_spool
+from electricity_tracker.state import get_state_store
 import os
 import sys
 import logging
-import asyncio
-
-# Add project root to path to import dpdc.py
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
-
-# Import the DPDC function
-try:
-    from dpdc import check_balance_for_customer
-except ImportError:
-    logging.error("Failed to import dpdc.py. Make sure it exists in the project root directory.")
-    check_balance_for_customer = None
 
 class Command(BaseCommand):
     help = 'Fetches current balance from DPDC and saves to database'
+    # The cron job runs this every few minutes; skip the system checks
+    requires_system_checks = []
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -25,6 +17,11 @@ class Command(BaseCommand):
             type=str,
             help='DPDC customer number to use (overrides env variable)',
         )
+        parser.add_argument(
+            '--no-flush',
+            action='store_true',
+            help='Only spool the reading; leave the database write to flush_spool',
+        )
 
     def handle(self, *args, **options):
         # Setup logging
@@ -34,8 +31,15 @@ class Command(BaseCommand):
         )
         logger = logging.getLogger('fetch_balance')
         
-        # Ensure DPDC function is available
-        if check_balance_for_customer is None:
+        # dpdc.py and throttle.py sit next to manage.py; add that directory for
+        # runs through call_command (e.g. Celery) or django-admin
+        project_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        if project_dir not in sys.path:
+            sys.path.append(project_dir)
+        try:
+            from dpdc import check_balance_for_customer
+        except ImportError as e:
+            logger.error(f"Failed to import dpdc.py: {e}")
             self.stderr.write(self.style.ERROR('DPDC integration not available. Aborting.'))
             return
         
@@ -53,24 +57,46 @@ class Command(BaseCommand):
             balance_info = check_balance_for_customer(customer_number)
             
             if balance_info:
-                # Check if there's already a balance entry with this value
                 current_balance = float(balance_info['balance'])
                 
-                # Get the latest entry to compare
-                latest_entry = BalanceEntry.objects.order_by('-timestamp').first()
-                
-                if latest_entry and latest_entry.balance == current_balance:
+                # Compare with the current state (cached, so usually no query)
+                try:
+                    state = get_state_store().get(balance_info['account_id'])
+                except Exception as e:
+                    logger.warning(f"Current state unavailable, spooling anyway: {e}")
+                    state = None
+                if state and state['balance'] == current_balance:
                     self.stdout.write(self.style.SUCCESS(f'No change in balance detected (still {current_balance} Tk). Skipping database entry.'))
                     return None
                 
-                # Create entry in database only if balance has changed or this is the first entry
-                entry = BalanceEntry.objects.create(
-                    balance=current_balance,
-                    account_id=balance_info['account_id'],
-                    customer_name=balance_info['customer_name'],
-                    status=balance_info['status'],
-                    timestamp=timezone.now()
-                )
+                # Spool the reading first so it survives a database outage
+                spool = ReadingSpool()
+                spool.append({
+                    'balance': current_balance,
+                    'account_id': balance_info['account_id'],
+                    'customer_name': balance_info['customer_name'],
+                    'status': balance_info['status'],
+                    'timestamp': timezone.now(),
+                })
+                
+                if options.get('no_flush'):
+                    self.stdout.write(self.style.SUCCESS(f'Balance spooled: {current_balance} Tk'))
+                    return None
+                
+                try:
+                    _, entries = flush_spool(spool)
+                except Exception as e:
+                    self.stderr.write(self.style.WARNING(
+                        f'Database unavailable, reading kept in spool ({spool.pending()} pending): {e}'
+                    ))
+                    logger.warning(f"Flush failed: {e}", exc_info=True)
+                    return None
+                
+                # Only changed balances are written by the flusher
+                entry = next((e for e in reversed(entries) if e.account_id == balance_info['account_id']), None)
+                if entry is None or entry.balance != current_balance:
+                    self.stdout.write(self.style.SUCCESS(f'No change in balance detected (still {current_balance} Tk). Skipping database entry.'))
+                    return None
 
                 self.stdout.write(self.style.SUCCESS(f'Balance changed - new value saved: {current_balance} Tk'))
                 self.stdout.write(f'Calculated hourly usage: {entry.hourly_usage} Tk')
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from electricity_tracker.spool import ReadingSpool, flush_spool
+import time
+import logging
+
+class Command(BaseCommand):
+    help = 'Flushes spooled balance readings to the database in batches'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Readings per database transaction (defaults to SPOOL_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--watch',
+            type=float,
+            metavar='SECONDS',
+            help='Keep running and flush every SECONDS seconds',
+        )
+
+    def handle(self, *args, **options):
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
+        logger = logging.getLogger('flush_spool')
+        spool = ReadingSpool()
+        interval = options.get('watch')
+
+        while True:
+            try:
+                readings, entries = flush_spool(spool, batch_size=options.get('batch_size'))
+                if readings:
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Flushed {readings} readings ({len(entries)} balance changes saved)'
+                    ))
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(
+                    f'Flush failed, {spool.pending()} readings kept in spool: {str(e)}'
+                ))
+                logger.error(f"Error: {str(e)}", exc_info=True)
+
+            if not interval:
+                return None
+            time.sleep(interval)
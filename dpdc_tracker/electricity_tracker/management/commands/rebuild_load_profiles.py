@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from electricity_tracker.models import BalanceEntry, LoadProfile
+from electricity_tracker.archive import iter_archived_entries
+from electricity_tracker.load_profile import add_reading, empty_buckets, save_buckets
+
+class Command(BaseCommand):
+    help = 'Rebuilds hour-of-week load profiles from stored and archived balance entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--account',
+            type=str,
+            help='Only rebuild the profile of this account ID',
+        )
+        parser.add_argument(
+            '--skip-archive',
+            action='store_true',
+            help='Ignore entries compacted into the archive',
+        )
+
+    def handle(self, *args, **options):
+        account_id = options.get('account')
+        profiles = {}
+        seen = set()
+
+        def add(account, timestamp, usage):
+            if account:
+                add_reading(profiles.setdefault(account, empty_buckets()), timestamp, usage)
+
+        if not options.get('skip_archive'):
+            for record in iter_archived_entries(account_id=account_id):
+                seen.add(record['id'])
+                add(record['account_id'], record['timestamp'], record['hourly_usage'])
+
+        entries = BalanceEntry.objects.filter(hourly_usage__gt=0)
+        if account_id:
+            entries = entries.filter(account_id=account_id)
+        # An interrupted compaction can leave rows both archived and stored
+        for pk, account, timestamp, usage in entries.values_list('id', 'account_id', 'timestamp', 'hourly_usage').iterator(chunk_size=5000):
+            if str(pk) not in seen:
+                add(account, timestamp, usage)
+
+        stale = LoadProfile.objects.exclude(account_id__in=list(profiles))
+        if account_id:
+            stale = stale.filter(account_id=account_id)
+        stale.delete()
+        for account, buckets in profiles.items():
+            save_buckets(account, buckets)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt load profiles for {len(profiles)} accounts'))
@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from electricity_tracker.state import get_state_store
+
+class Command(BaseCommand):
+    help = 'Loads the latest balance and usage totals of every account into the shared (Redis) current state store'
+
+    def handle(self, *args, **options):
+        # Without Redis the states would only fill this process's own cache
+        if not settings.STATE_REDIS_URL:
+            raise CommandError('STATE_REDIS_URL is not set; warming only works with a Redis-backed state store')
+        count = get_state_store().warm()
+        self.stdout.write(self.style.SUCCESS(f'Warmed current state for {count} accounts'))
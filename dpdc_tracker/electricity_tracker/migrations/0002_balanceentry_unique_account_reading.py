@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('electricity_tracker', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='balanceentry',
+            constraint=models.UniqueConstraint(fields=('account_id', 'timestamp'), name='unique_account_reading'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('electricity_tracker', '0002_balanceentry_unique_account_reading'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyUsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_id', models.CharField(blank=True, max_length=20, null=True)),
+                ('date', models.DateField(help_text='Local (Asia/Dhaka) date of the compacted entries')),
+                ('total_usage', models.FloatField(default=0)),
+                ('avg_balance', models.FloatField(default=0)),
+                ('min_balance', models.FloatField(blank=True, null=True)),
+                ('max_balance', models.FloatField(blank=True, null=True)),
+                ('last_balance', models.FloatField(blank=True, null=True)),
+                ('entry_count', models.IntegerField(default=0)),
+                ('first_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Daily Usage Rollup',
+                'verbose_name_plural': 'Daily Usage Rollups',
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['date'], name='electricity_date_a0e587_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyusagerollup',
+            constraint=models.UniqueConstraint(fields=('account_id', 'date'), name='unique_account_rollup_date'),
+        ),
+    ]
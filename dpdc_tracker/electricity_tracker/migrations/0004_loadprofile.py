@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 03:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('electricity_tracker', '0003_dailyusagerollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoadProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_id', models.CharField(max_length=20, unique=True)),
+                ('counts', models.JSONField(default=list, help_text='Readings with usage per hour-of-week')),
+                ('sums', models.JSONField(default=list, help_text='Total usage per hour-of-week')),
+                ('histograms', models.JSONField(default=list, help_text='Usage histogram per hour-of-week')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Load Profile',
+                'verbose_name_plural': 'Load Profiles',
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-19 03:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('electricity_tracker', '0004_loadprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnomalyDetectorState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_id', models.CharField(max_length=20, unique=True)),
+                ('state', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Anomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_id', models.CharField(max_length=20)),
+                ('timestamp', models.DateTimeField()),
+                ('kind', models.CharField(choices=[('usage_spike', 'Usage spike'), ('meter_reset', 'Meter reset'), ('balance_jump', 'Balance jump')], max_length=20)),
+                ('balance', models.FloatField(help_text='Balance of the flagged reading')),
+                ('value', models.FloatField(help_text='Usage rate (Tk/hour) or balance change that was flagged')),
+                ('expected', models.FloatField(blank=True, help_text='Typical value at the time', null=True)),
+                ('score', models.FloatField(blank=True, help_text='Robust z-score of the value', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('entry', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='anomalies', to='electricity_tracker.balanceentry')),
+            ],
+            options={
+                'verbose_name': 'Anomaly',
+                'verbose_name_plural': 'Anomalies',
+                'ordering': ['-timestamp'],
+                'indexes': [models.Index(fields=['account_id', '-timestamp'], name='electricity_account_e7ef09_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='anomaly',
+            constraint=models.UniqueConstraint(fields=('account_id', 'timestamp', 'kind'), name='unique_account_anomaly'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 03:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('electricity_tracker', '0005_anomaly'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RechargeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_id', models.CharField(max_length=20)),
+                ('timestamp', models.DateTimeField(help_text='Time of the first reading after the recharge')),
+                ('amount', models.FloatField(help_text='Balance increase in Taka')),
+                ('balance_before', models.FloatField()),
+                ('balance_after', models.FloatField()),
+                ('entry', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recharges', to='electricity_tracker.balanceentry')),
+            ],
+            options={
+                'verbose_name': 'Recharge Event',
+                'verbose_name_plural': 'Recharge Events',
+                'ordering': ['-timestamp'],
+                'indexes': [models.Index(fields=['account_id', '-timestamp'], name='electricity_account_7326e2_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='rechargeevent',
+            constraint=models.UniqueConstraint(fields=('account_id', 'timestamp'), name='unique_account_recharge'),
+        ),
+    ]
@@ -28,25 +28,36 @@ class BalanceEntry(models.Model):
         except (ValueError, TypeError):
             self.balance = 0.0
             
-        # Calculate hourly usage based on previous entry
-        prev_entry = BalanceEntry.objects.order_by('-timestamp').first()
+        # Calculate hourly usage based on previous entry for the same meter
+        prev_entry = self.previous_entry()
         if prev_entry:
-            time_diff = self.timestamp - prev_entry.timestamp
-            # Only calculate if previous entry is within reasonable time (less than 3 hours)
-            if time_diff.total_seconds() < 10800:  # 3 hours = 10800 seconds
-                try:
-                    prev_balance = float(prev_entry.balance)
-                    current_balance = float(self.balance)
-                    self.hourly_usage = max(0, prev_balance - current_balance)
-                except (ValueError, TypeError):
-                    self.hourly_usage = 0
-            else:
-                self.hourly_usage = 0
+            self.hourly_usage = self.calculate_usage(
+                prev_entry.balance, prev_entry.timestamp, self.balance, self.timestamp
+            )
         else:
             self.hourly_usage = 0
         
         super().save(*args, **kwargs)
     
+    def previous_entry(self):
+        """Return the latest stored entry for this entry's account"""
+        entries = BalanceEntry.objects.all()
+        if self.account_id:
+            entries = entries.filter(account_id=self.account_id)
+        return entries.order_by('-timestamp').first()
+
+    @staticmethod
+    def calculate_usage(prev_balance, prev_timestamp, balance, timestamp):
+        """Usage between two readings, 0 if they are too far apart to compare"""
+        time_diff = timestamp - prev_timestamp
+        # Only calculate if previous entry is within reasonable time (less than 3 hours)
+        if time_diff.total_seconds() >= 10800:  # 3 hours = 10800 seconds
+            return 0
+        try:
+            return max(0, float(prev_balance) - float(balance))
+        except (ValueError, TypeError):
+            return 0
+    
     class Meta:
         ordering = ['-timestamp']
         verbose_name = "Balance Entry"
@@ -55,6 +66,133 @@ class BalanceEntry(models.Model):
             models.Index(fields=['timestamp']),
             models.Index(fields=['balance'])
         ]
+        constraints = [
+            # Spooled readings may be flushed more than once
+            models.UniqueConstraint(fields=['account_id', 'timestamp'], name='unique_account_reading'),
+        ]
+    
+    def __str__(self):
+        return f"{self.timestamp.strftime('%Y-%m-%d %H:%M')}: {self.balance} Tk"
+
+class DailyUsageRollup(models.Model):
+    """
+    Daily aggregate of balance entries that were compacted out of BalanceEntry
+    """
+    account_id = models.CharField(max_length=20, blank=True, null=True)
+    date = models.DateField(help_text="Local (Asia/Dhaka) date of the compacted entries")
+    total_usage = models.FloatField(default=0)
+    avg_balance = models.FloatField(default=0)
+    min_balance = models.FloatField(null=True, blank=True)
+    max_balance = models.FloatField(null=True, blank=True)
+    last_balance = models.FloatField(null=True, blank=True)
+    entry_count = models.IntegerField(default=0)
+    first_timestamp = models.DateTimeField(null=True, blank=True)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-date']
+        verbose_name = "Daily Usage Rollup"
+        verbose_name_plural = "Daily Usage Rollups"
+        indexes = [
+            models.Index(fields=['date'])
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['account_id', 'date'], name='unique_account_rollup_date'),
+        ]
+    
+    def __str__(self):
+        return f"{self.date}: {self.total_usage} Tk ({self.entry_count} entries)"
+
+
+class LoadProfile(models.Model):
+    """
+    Hour-of-week usage profile of an account, updated incrementally on ingest.
+
+    Each list has one slot per local hour of the week (Monday 00:00 is 0).
+    """
+    account_id = models.CharField(max_length=20, unique=True)
+    counts = models.JSONField(default=list, help_text="Readings with usage per hour-of-week")
+    sums = models.JSONField(default=list, help_text="Total usage per hour-of-week")
+    histograms = models.JSONField(default=list, help_text="Usage histogram per hour-of-week")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Load Profile"
+        verbose_name_plural = "Load Profiles"
+    
+    def __str__(self):
+        return f"Load profile for {self.account_id}"
+
+
+class AnomalyDetectorState(models.Model):
+    """Rolling statistics of an account's usage rate used by the anomaly detector"""
+    account_id = models.CharField(max_length=20, unique=True)
+    state = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Anomaly detector state for {self.account_id}"
+
+
+class Anomaly(models.Model):
+    """
+    Reading flagged as unusual by the streaming anomaly detector
+    """
+    USAGE_SPIKE = 'usage_spike'
+    METER_RESET = 'meter_reset'
+    BALANCE_JUMP = 'balance_jump'
+    KIND_CHOICES = [
+        (USAGE_SPIKE, 'Usage spike'),
+        (METER_RESET, 'Meter reset'),
+        (BALANCE_JUMP, 'Balance jump'),
+    ]
+    
+    account_id = models.CharField(max_length=20)
+    timestamp = models.DateTimeField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    entry = models.ForeignKey(BalanceEntry, null=True, blank=True, on_delete=models.SET_NULL, related_name='anomalies')
+    balance = models.FloatField(help_text="Balance of the flagged reading")
+    value = models.FloatField(help_text="Usage rate (Tk/hour) or balance change that was flagged")
+    expected = models.FloatField(null=True, blank=True, help_text="Typical value at the time")
+    score = models.FloatField(null=True, blank=True, help_text="Robust z-score of the value")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-timestamp']
+        verbose_name = "Anomaly"
+        verbose_name_plural = "Anomalies"
+        indexes = [
+            models.Index(fields=['account_id', '-timestamp']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['account_id', 'timestamp', 'kind'], name='unique_account_anomaly'),
+        ]
+    
+    def __str__(self):
+        return f"{self.timestamp.strftime('%Y-%m-%d %H:%M')}: {self.get_kind_display()} ({self.account_id})"
+
+
+class RechargeEvent(models.Model):
+    """
+    Balance increase of at least RECHARGE_MIN_AMOUNT, detected at ingest
+    """
+    account_id = models.CharField(max_length=20)
+    timestamp = models.DateTimeField(help_text="Time of the first reading after the recharge")
+    amount = models.FloatField(help_text="Balance increase in Taka")
+    balance_before = models.FloatField()
+    balance_after = models.FloatField()
+    entry = models.ForeignKey(BalanceEntry, null=True, blank=True, on_delete=models.SET_NULL, related_name='recharges')
+    
+    class Meta:
+        ordering = ['-timestamp']
+        verbose_name = "Recharge Event"
+        verbose_name_plural = "Recharge Events"
+        indexes = [
+            models.Index(fields=['account_id', '-timestamp']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['account_id', 'timestamp'], name='unique_account_recharge'),
+        ]
     
     def __str__(self):
-        return f"{self.timestamp.strftime('%Y-%m-%d %H:%M')}: {self.balance} Tk"
\ No newline at end of file
+        return f"{self.timestamp.strftime('%Y-%m-%d %H:%M')}: +{self.amount} Tk ({self.account_id})"
@@ -0,0 +1,147 @@
+"""
+Publish/subscribe fan-out of new balance entries for the live stream.
+
+LocalBroker delivers within one process. RedisBroker publishes through Redis
+so readings ingested by another process (e.g. the fetch_balance cron job)
+reach subscribers; each server process keeps a single Redis subscription
+and fans messages out to its local subscribers.
+"""
+import json
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger('pubsub')
+
+ALL_ACCOUNTS = '*'
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def entry_payload(entry):
+    """JSON-serialisable representation of a balance entry"""
+    return {
+        'id': str(entry.id),
+        'timestamp': timezone.localtime(entry.timestamp).isoformat(),
+        'balance': entry.balance,
+        'hourly_usage': entry.hourly_usage,
+        'customer_name': entry.customer_name,
+        'account_id': entry.account_id,
+        'status': entry.status,
+    }
+
+
+def _offer(queue, message):
+    # Slow subscribers lose their oldest message rather than blocking publishers
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+class LocalBroker:
+    """In-process fan-out to asyncio subscribers on any event loop"""
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def _dispatch(self, channel, message):
+        with self._lock:
+            targets = set(self._subscribers.get(channel, ())) | set(self._subscribers.get(ALL_ACCOUNTS, ()))
+        for loop, queue in targets:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, message)
+            except RuntimeError:
+                # Event loop already closed
+                pass
+
+    def publish(self, channel, message):
+        """Deliver a message to subscribers of channel (an account ID)"""
+        self._dispatch(channel or ALL_ACCOUNTS, message)
+
+    async def _on_subscribe(self):
+        pass
+
+    @asynccontextmanager
+    async def subscribe(self, channel=None):
+        """Yield a queue receiving messages for channel, or for every account if None"""
+        await self._on_subscribe()
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(SUBSCRIBER_QUEUE_SIZE))
+        key = channel or ALL_ACCOUNTS
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                self._subscribers[key].discard(subscriber)
+                if not self._subscribers[key]:
+                    del self._subscribers[key]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+class RedisBroker(LocalBroker):
+    """Fan-out through Redis pub/sub with one listener per process and event loop"""
+    def __init__(self, url, prefix='dpdc:balance:'):
+        super().__init__()
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+        self._listeners = {}
+
+    def publish(self, channel, message):
+        import redis
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(f"{self.prefix}{channel or ALL_ACCOUNTS}", json.dumps(message))
+
+    async def _on_subscribe(self):
+        loop = asyncio.get_running_loop()
+        listener = self._listeners.get(loop)
+        if listener is None or listener.done():
+            self._listeners[loop] = loop.create_task(self._listen())
+
+    async def _listen(self):
+        import redis.asyncio as aioredis
+        while True:
+            client = aioredis.Redis.from_url(self.url)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(f"{self.prefix}*")
+                    async for message in pubsub.listen():
+                        if message['type'] != 'pmessage':
+                            continue
+                        channel = message['channel'].decode()[len(self.prefix):]
+                        self._dispatch(channel, json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis subscription failed, reconnecting: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+
+_broker = None
+
+def get_broker():
+    """Return the process-wide broker, backed by Redis if PUBSUB_REDIS_URL is set"""
+    global _broker
+    if _broker is None:
+        if settings.PUBSUB_REDIS_URL:
+            _broker = RedisBroker(settings.PUBSUB_REDIS_URL)
+        else:
+            _broker = LocalBroker()
+    return _broker
+
+
+def publish_entries(sender, entries, **kwargs):
+    """readings_ingested receiver pushing new entries to stream subscribers"""
+    broker = get_broker()
+    for entry in entries:
+        broker.publish(entry.account_id, entry_payload(entry))
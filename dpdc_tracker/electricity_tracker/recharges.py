@@ -0,0 +1,53 @@
+"""
+Recharge detection.
+
+A recharge is a balance increase of at least RECHARGE_MIN_AMOUNT between two
+consecutive readings of an account. Events are recorded at ingest so that
+recharge history and spend since the last recharge are indexed lookups.
+"""
+import logging
+
+from django.conf import settings
+
+from .models import BalanceEntry, RechargeEvent
+
+logger = logging.getLogger('recharges')
+
+
+def recharge_between(account_id, balance_before, balance_after, timestamp, entry_id=None):
+    """Return a RechargeEvent if the balance change is a recharge, else None"""
+    if balance_before is None or balance_after - balance_before < settings.RECHARGE_MIN_AMOUNT:
+        return None
+    return RechargeEvent(
+        account_id=account_id,
+        timestamp=timestamp,
+        amount=balance_after - balance_before,
+        balance_before=balance_before,
+        balance_after=balance_after,
+        entry_id=entry_id,
+    )
+
+
+def record_recharges(sender, entries, **kwargs):
+    """readings_stored receiver recording recharges among new entries"""
+    by_account = {}
+    for entry in entries:
+        if entry.account_id:
+            by_account.setdefault(entry.account_id, []).append(entry)
+
+    events = []
+    for account_id, account_entries in by_account.items():
+        account_entries.sort(key=lambda e: e.timestamp)
+        previous = BalanceEntry.objects.filter(
+            account_id=account_id, timestamp__lt=account_entries[0].timestamp
+        ).order_by('-timestamp').values_list('balance', flat=True).first()
+        for entry in account_entries:
+            event = recharge_between(account_id, previous, entry.balance, entry.timestamp, entry.pk)
+            if event:
+                events.append(event)
+            previous = entry.balance
+
+    if events:
+        RechargeEvent.objects.bulk_create(events, ignore_conflicts=True)
+        for event in events:
+            logger.info(f"Recharge of {event.amount:.2f} Tk detected for {event.account_id} at {event.timestamp}")
@@ -0,0 +1,54 @@
+"""
+Database routing for the analytics views.
+
+Reads go to the primary unless code opts in with ``use_read_replica()``,
+which the read-only usage views do. Once anything is written inside that
+scope, the rest of the scope reads from the primary again so it sees its
+own writes despite replication lag.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_read_scope = ContextVar('analytics_read_scope', default=None)
+
+
+@contextmanager
+def use_read_replica():
+    """Route reads in this block to ANALYTICS_DB_ALIAS"""
+    token = _read_scope.set({'alias': settings.ANALYTICS_DB_ALIAS, 'wrote': False})
+    try:
+        yield
+    finally:
+        _read_scope.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """Route reads in this block to the primary, e.g. inside a replica scope"""
+    token = _read_scope.set(None)
+    try:
+        yield
+    finally:
+        _read_scope.reset(token)
+
+
+class AnalyticsRouter:
+    """Send opted-in reads to the analytics alias and everything else to the primary"""
+    def db_for_read(self, model, **hints):
+        scope = _read_scope.get()
+        if scope is None or scope['wrote']:
+            return DEFAULT_DB_ALIAS
+        return scope['alias']
+
+    def db_for_write(self, model, **hints):
+        scope = _read_scope.get()
+        if scope is not None:
+            scope['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica mirrors the primary, so objects from either may be related
+        return True
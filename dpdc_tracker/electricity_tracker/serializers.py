@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import BalanceEntry
+from .models import BalanceEntry, Anomaly, RechargeEvent
 
 class BalanceEntrySerializer(serializers.ModelSerializer):
     class Meta:
@@ -17,4 +17,25 @@ class MonthlyUsageSerializer(serializers.Serializer):
     month = serializers.IntegerField()
     total_usage = serializers.FloatField()
     avg_daily_usage = serializers.FloatField()
-    days_with_data = serializers.IntegerField()
\ No newline at end of file
+    days_with_data = serializers.IntegerField()
+
+class AccountSummarySerializer(serializers.Serializer):
+    rank = serializers.IntegerField()
+    account_id = serializers.CharField()
+    customer_name = serializers.CharField(allow_null=True)
+    total_usage = serializers.FloatField()
+    avg_usage = serializers.FloatField()
+    avg_balance = serializers.FloatField()
+    entry_count = serializers.IntegerField()
+    last_reading = serializers.DateTimeField(allow_null=True)
+    last_balance = serializers.FloatField(allow_null=True)
+
+class AnomalySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Anomaly
+        fields = ['id', 'timestamp', 'account_id', 'kind', 'balance', 'value', 'expected', 'score', 'entry']
+
+class RechargeEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RechargeEvent
+        fields = ['id', 'timestamp', 'account_id', 'amount', 'balance_before', 'balance_after', 'entry']
\ No newline at end of file
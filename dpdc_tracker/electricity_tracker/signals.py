@@ -0,0 +1,14 @@
+from django.dispatch import Signal
+
+# Sent inside the transaction that stores a batch of new balance entries.
+# Receivers that keep database indexes (load profiles, anomalies, recharges)
+# in step with BalanceEntry connect here: if one raises, the batch is rolled
+# back and stays in the spool for the next flush, so no index misses entries.
+# Receivers get ``entries``, a list of BalanceEntry instances ordered by
+# timestamp; readings that were already stored are never sent twice.
+readings_stored = Signal()
+
+# Sent after the batch has been committed, with the same ``entries``, for
+# receivers outside the database (the current state store, the live stream).
+# Their failures are logged and do not fail the flush.
+readings_ingested = Signal()
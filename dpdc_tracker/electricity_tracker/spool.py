@@ -0,0 +1,208 @@
+"""
+Write-ahead spool for fetched balance readings.
+
+Fetches append readings to a local NDJSON file and fsync it before returning,
+so a reading survives a slow or unavailable database. A flusher later moves
+the pending file aside, writes its readings to BalanceEntry in batches and
+removes it. Flushing is idempotent on (account_id, timestamp), so a crash
+half way through a flush only means the same readings are offered again.
+"""
+import os
+import json
+import fcntl
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import BalanceEntry
+from .signals import readings_ingested, readings_stored
+
+logger = logging.getLogger('spool')
+
+
+class ReadingSpool:
+    """Append-only NDJSON spool of readings awaiting a database flush"""
+    def __init__(self, path=None):
+        self.path = str(path or settings.SPOOL_PATH)
+        self.flushing_path = f"{self.path}.flushing"
+        self.lock_path = f"{self.path}.lock"
+        self.flush_lock_path = f"{self.path}.flush.lock"
+
+    @contextmanager
+    def _locked(self, lock_path, blocking=True):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(lock_path, 'a') as lock:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _fsync_dir(self):
+        fd = os.open(os.path.dirname(self.path) or '.', os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def append(self, reading):
+        """Durably append one reading (a dict with a datetime 'timestamp')"""
+        record = dict(reading, timestamp=reading['timestamp'].isoformat())
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._locked(self.lock_path):
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, line.encode('utf-8'))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def claim(self):
+        """Move pending readings aside for flushing and return them"""
+        with self._locked(self.lock_path):
+            # A leftover flushing file means an earlier flush did not finish;
+            # replay it before claiming anything new
+            if not os.path.exists(self.flushing_path):
+                if not os.path.exists(self.path):
+                    return []
+                os.replace(self.path, self.flushing_path)
+                self._fsync_dir()
+
+        readings = []
+        with open(self.flushing_path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+                except (ValueError, KeyError) as e:
+                    # Most likely a torn write at the end of the file
+                    logger.warning(f"Skipping unreadable spool line {line_number}: {e}")
+                    continue
+                readings.append(record)
+        return readings
+
+    def release(self):
+        """Drop the claimed readings once they are safely in the database"""
+        if os.path.exists(self.flushing_path):
+            os.remove(self.flushing_path)
+            self._fsync_dir()
+
+    def pending(self):
+        """Number of readings not yet flushed"""
+        count = 0
+        for path in (self.flushing_path, self.path):
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    count += sum(1 for line in f if line.strip())
+        return count
+
+
+def _write_batch(readings, last_seen):
+    """Insert a batch of readings, skipping unchanged balances; return the new entries"""
+    readings = sorted(readings, key=lambda r: r['timestamp'])
+
+    # One indexed lookup per account per batch for the reading that precedes
+    # the batch. The current state store is not consulted: it may be stale
+    # if an ingest receiver failed, and a stale balance would be re-inserted.
+    for account_id in {r.get('account_id') for r in readings} - set(last_seen):
+        first_timestamp = min(r['timestamp'] for r in readings if r.get('account_id') == account_id)
+        prev = BalanceEntry.objects.filter(
+            account_id=account_id, timestamp__lt=first_timestamp
+        ).order_by('-timestamp').values('balance', 'timestamp').first()
+        last_seen[account_id] = (prev['balance'], prev['timestamp']) if prev else None
+
+    entries = []
+    for reading in readings:
+        account_id = reading.get('account_id')
+        try:
+            balance = float(reading['balance'])
+        except (KeyError, ValueError, TypeError):
+            balance = 0.0
+        prev = last_seen[account_id]
+        if prev and prev[0] == balance:
+            # Only record changes in balance
+            continue
+        hourly_usage = BalanceEntry.calculate_usage(prev[0], prev[1], balance, reading['timestamp']) if prev else 0
+        entries.append(BalanceEntry(
+            timestamp=reading['timestamp'],
+            balance=balance,
+            original_balance=balance,
+            hourly_usage=hourly_usage,
+            account_id=account_id,
+            customer_name=reading.get('customer_name'),
+            status=reading.get('status'),
+        ))
+        last_seen[account_id] = (balance, reading['timestamp'])
+
+    if not entries:
+        return entries
+
+    # Drop readings a previous, interrupted flush already stored
+    stored = set(BalanceEntry.objects.filter(
+        account_id__in={e.account_id for e in entries},
+        timestamp__in=[e.timestamp for e in entries]
+    ).values_list('account_id', 'timestamp'))
+    entries = [e for e in entries if (e.account_id, e.timestamp) not in stored]
+
+    with transaction.atomic():
+        BalanceEntry.objects.bulk_create(entries, ignore_conflicts=True)
+        # Database receivers commit or roll back together with the batch
+        readings_stored.send(sender=BalanceEntry, entries=entries)
+    return entries
+
+
+def _notify(entries):
+    """Tell post-commit receivers about new entries without letting them fail the flush"""
+    for receiver, result in readings_ingested.send_robust(sender=BalanceEntry, entries=entries):
+        if isinstance(result, Exception):
+            logger.error(f"Ingest receiver {receiver.__name__} failed: {result}", exc_info=result)
+
+
+def flush_spool(spool=None, batch_size=None):
+    """
+    Flush pending spooled readings to the database.
+
+    Returns a (readings, entries) tuple with the number of readings read from
+    the spool and the list of entries written for changed balances. Database
+    errors, including failures of readings_stored receivers, propagate and
+    leave the readings in the spool for the next flush.
+    """
+    spool = spool or ReadingSpool()
+    batch_size = batch_size or settings.SPOOL_BATCH_SIZE
+    total_readings = 0
+    written = []
+
+    with spool._locked(spool.flush_lock_path, blocking=False) as acquired:
+        if not acquired:
+            logger.info("Another flusher is running, skipping")
+            return 0, []
+
+        while True:
+            readings = spool.claim()
+            if not readings:
+                spool.release()
+                if os.path.exists(spool.path):
+                    continue
+                break
+            last_seen = {}
+            for start in range(0, len(readings), batch_size):
+                entries = _write_batch(readings[start:start + batch_size], last_seen)
+                written.extend(entries)
+                if entries:
+                    _notify(entries)
+            spool.release()
+            total_readings += len(readings)
+
+    if total_readings:
+        logger.info(f"Flushed {total_readings} spooled readings ({len(written)} balance changes)")
+    return total_readings, written
@@ -0,0 +1,367 @@
+"""
+Current state per account: latest reading plus running usage totals.
+
+State is updated write-through when the spool flusher ingests entries and is
+held in a process-local LRU, backed by a Redis hash when STATE_REDIS_URL is
+set so every process shares it. Local copies expire after
+STATE_LOCAL_TTL_SECONDS because other processes may ingest newer readings.
+On a miss only the latest reading is loaded, with one indexed query, and
+cached again. Running totals (total_usage, entry_count) are filled in by
+warm() and kept up to date on ingest; states loaded on a miss have none.
+Warming needs Redis: without it the warmed states live only in the LRU of
+the warming process and expire with the rest of it.
+
+Every state carries ``hw``, the high-water mark (epoch milliseconds) of the
+newest reading folded into it. Updates are merged against it atomically, in
+Redis by Lua scripts, so readings at or before the mark are never counted
+twice and an older state never replaces a newer one.
+"""
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Count, Max, OuterRef, Subquery, Sum
+
+from .models import BalanceEntry, DailyUsageRollup
+from .pubsub import entry_payload
+from .routers import use_primary
+
+logger = logging.getLogger('state')
+
+LATEST_KEY = '__latest__'
+
+# Store a state unless the stored one is newer, or as new and carrying totals
+STORE_SCRIPT = """
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+if raw then
+    local current = cjson.decode(raw)
+    local state = cjson.decode(ARGV[2])
+    local current_hw = current['hw'] or -1
+    if current_hw > state['hw'] or (current_hw == state['hw'] and (current['total_usage'] or not state['total_usage'])) then
+        return raw
+    end
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return ARGV[2]
+"""
+
+# Fold readings newer than the stored high-water mark into the stored state
+FOLD_SCRIPT = """
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+local current = raw and cjson.decode(raw)
+local update = cjson.decode(ARGV[2])
+local hw = current and current['hw'] or -1
+local usage, count = 0, 0
+for _, reading in ipairs(update['readings']) do
+    if reading[1] > hw then
+        usage = usage + reading[2]
+        count = count + 1
+    end
+end
+if count == 0 then
+    return raw
+end
+local state = update['state']
+if current and current['total_usage'] then
+    state['total_usage'] = current['total_usage'] + usage
+    state['entry_count'] = current['entry_count'] + count
+end
+local encoded = cjson.encode(state)
+redis.call('HSET', KEYS[1], ARGV[1], encoded)
+return encoded
+"""
+
+
+def _epoch_ms(timestamp):
+    return int(round(timestamp.timestamp() * 1000))
+
+
+def entry_state(entry):
+    """State holding a single entry as the latest reading, without totals"""
+    return dict(entry_payload(entry), hw=_epoch_ms(entry.timestamp))
+
+
+def _prefer(current, state):
+    """The state STORE_SCRIPT keeps when state is offered over current"""
+    if current is None:
+        return state
+    current_hw = current.get('hw', -1)
+    if current_hw > state['hw']:
+        return current
+    if current_hw == state['hw'] and ('total_usage' in current or 'total_usage' not in state):
+        return current
+    return state
+
+
+def _fold(current, state, readings):
+    """The state FOLD_SCRIPT stores, or current if no reading is newer than it"""
+    hw = current.get('hw', -1) if current else -1
+    newer = [usage for reading_hw, usage in readings if reading_hw > hw]
+    if not newer:
+        return current
+    state = dict(state)
+    if current and 'total_usage' in current:
+        state['total_usage'] = current['total_usage'] + sum(newer)
+        state['entry_count'] = current['entry_count'] + len(newer)
+    return state
+
+
+class CurrentStateStore:
+    """LRU of per-account state with an optional shared Redis backing"""
+    def __init__(self, max_entries=None, ttl=None, redis_url=None, redis_key='dpdc:state'):
+        self.max_entries = max_entries or settings.STATE_CACHE_SIZE
+        self.ttl = settings.STATE_LOCAL_TTL_SECONDS if ttl is None else ttl
+        self.redis_key = redis_key
+        self._redis = None
+        if redis_url:
+            import redis
+            self._redis = redis.Redis.from_url(redis_url)
+            self._store_script = self._redis.register_script(STORE_SCRIPT)
+            self._fold_script = self._redis.register_script(FOLD_SCRIPT)
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Local LRU
+
+    def _get_local_locked(self, key):
+        item = self._local.get(key)
+        if item is None:
+            return None
+        expires, state = item
+        if expires is not None and expires < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return state
+
+    def _put_local_locked(self, key, state):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self._local[key] = (expires, state)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    def get_local(self, key):
+        """Return cached state without any I/O, or None"""
+        with self._lock:
+            return self._get_local_locked(key)
+
+    def _put_local(self, key, state):
+        with self._lock:
+            self._put_local_locked(key, state)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    # Shared backing
+
+    def _get_shared(self, key):
+        if self._redis is None:
+            return None
+        raw = self._redis.hget(self.redis_key, key)
+        return json.loads(raw) if raw else None
+
+    def _put(self, states):
+        """
+        Offer states (a dict of key -> state) to Redis, or the LRU without
+        Redis, keeping newer stored states. Returns the states now stored.
+        """
+        stored = {}
+        if self._redis is not None:
+            pipe = self._redis.pipeline(transaction=False)
+            for key, state in states.items():
+                self._store_script(keys=[self.redis_key], args=[key, json.dumps(state)], client=pipe)
+            for key, raw in zip(states, pipe.execute()):
+                stored[key] = json.loads(raw)
+                self._put_local(key, stored[key])
+            return stored
+        with self._lock:
+            for key, state in states.items():
+                stored[key] = _prefer(self._get_local_locked(key), state)
+                self._put_local_locked(key, stored[key])
+        return stored
+
+    def _fold_readings(self, key, state, readings):
+        """Fold readings ([hw, usage] pairs) into the stored state; return the stored state"""
+        if self._redis is not None:
+            raw = self._fold_script(
+                keys=[self.redis_key], args=[key, json.dumps({'state': state, 'readings': readings})]
+            )
+            stored = json.loads(raw) if raw else None
+            if stored is not None:
+                self._put_local(key, stored)
+            return stored
+        with self._lock:
+            current = self._get_local_locked(key)
+            stored = _fold(current, state, readings)
+            if stored is not current:
+                self._put_local_locked(key, stored)
+            return stored
+
+    # Database fallback
+
+    def _load(self, account_id):
+        """Load an account's latest reading from the primary database"""
+        # Never fill the shared store from a possibly lagging replica
+        with use_primary():
+            latest_entry = BalanceEntry.objects.filter(account_id=account_id).order_by('-timestamp').first()
+        return entry_state(latest_entry) if latest_entry else None
+
+    # Public API
+
+    def peek(self, key):
+        """Return state from the LRU or Redis without falling back to the database"""
+        state = self.get_local(key)
+        if state is None:
+            state = self._get_shared(key)
+            if state is not None:
+                self._put_local(key, state)
+        return state
+
+    def get_latest_local(self):
+        """Return the most recent account's state from the LRU only, or None"""
+        pointer = self.get_local(LATEST_KEY)
+        return self.get_local(pointer['account_id']) if pointer else None
+
+    def get(self, account_id):
+        """Return an account's state, consulting the LRU, Redis and then the database"""
+        state = self.get_local(account_id)
+        if state is not None:
+            return state
+        state = self._get_shared(account_id)
+        if state is None:
+            state = self._load(account_id)
+            if state is None:
+                return None
+            state = self._put({account_id: state})[account_id]
+        else:
+            self._put_local(account_id, state)
+        return state
+
+    def get_latest(self):
+        """Return the state of the account with the most recent reading"""
+        pointer = self.peek(LATEST_KEY)
+        if pointer is None:
+            with use_primary():
+                latest_entry = BalanceEntry.objects.order_by('-timestamp').first()
+            if latest_entry is None:
+                return None
+            state = entry_state(latest_entry)
+            pointer = {'account_id': latest_entry.account_id, 'timestamp': state['timestamp'], 'hw': state['hw']}
+            updates = {LATEST_KEY: pointer}
+            # Keep a cached state that may carry running totals
+            if self.peek(latest_entry.account_id) is None:
+                updates[latest_entry.account_id] = state
+            self._put(updates)
+        return self.get(pointer['account_id'])
+
+    def apply_entries(self, entries):
+        """Fold newly ingested entries into the stored state"""
+        by_account = {}
+        for entry in entries:
+            by_account.setdefault(entry.account_id, []).append(entry)
+
+        pointer = None
+        for account_id, account_entries in by_account.items():
+            newest = max(account_entries, key=lambda e: e.timestamp)
+            readings = [[_epoch_ms(e.timestamp), e.hourly_usage] for e in account_entries]
+            self._fold_readings(account_id, entry_state(newest), readings)
+            if pointer is None or _epoch_ms(newest.timestamp) > pointer['hw']:
+                state = entry_state(newest)
+                pointer = {'account_id': account_id, 'timestamp': state['timestamp'], 'hw': state['hw']}
+        if pointer:
+            self._put({LATEST_KEY: pointer})
+
+    def invalidate(self, keys):
+        """Drop states from Redis and the LRU so the next read reloads them"""
+        if self._redis is not None and keys:
+            self._redis.hdel(self.redis_key, *keys)
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    def warm(self):
+        """Load state and running totals for every account in a few grouped queries"""
+        with use_primary():
+            return self._warm()
+
+    def _warm(self):
+        totals = {
+            row['account_id']: row for row in
+            BalanceEntry.objects.values('account_id').annotate(
+                total=Sum('hourly_usage'), count=Count('id'), latest=Max('timestamp')
+            )
+        }
+        compacted = {
+            row['account_id']: row for row in
+            DailyUsageRollup.objects.values('account_id').annotate(total=Sum('total_usage'), count=Sum('entry_count'))
+        }
+        latest_timestamp = BalanceEntry.objects.filter(
+            account_id=OuterRef('account_id')
+        ).order_by('-timestamp').values('timestamp')[:1]
+        latest_entries = BalanceEntry.objects.filter(timestamp=Subquery(latest_timestamp))
+
+        states = {}
+        pointer = None
+        for entry in latest_entries:
+            if entry.account_id in states:
+                continue
+            state = entry_state(entry)
+            raw = totals.get(entry.account_id, {})
+            rolled = compacted.get(entry.account_id, {})
+            state['total_usage'] = (raw.get('total') or 0.0) + (rolled.get('total') or 0.0)
+            state['entry_count'] = (raw.get('count') or 0) + (rolled.get('count') or 0)
+            # The totals cover readings up to their own query's latest timestamp;
+            # a reading ingested after it is folded in when its receiver runs
+            if raw.get('latest'):
+                state['hw'] = min(state['hw'], _epoch_ms(raw['latest']))
+            states[entry.account_id] = state
+            if pointer is None or state['hw'] > pointer['hw']:
+                pointer = {'account_id': entry.account_id, 'timestamp': state['timestamp'], 'hw': state['hw']}
+        if pointer:
+            states[LATEST_KEY] = pointer
+        self._put(states)
+        return len(states) - (1 if pointer else 0)
+
+
+_store = None
+
+def get_state_store():
+    """Return the process-wide current state store"""
+    global _store
+    if _store is None:
+        _store = CurrentStateStore(redis_url=settings.STATE_REDIS_URL)
+    return _store
+
+
+def update_current_state(sender, entries, **kwargs):
+    """readings_ingested receiver keeping the current state write-through"""
+    store = get_state_store()
+    try:
+        store.apply_entries(entries)
+    except Exception:
+        # Don't leave a stale state behind; the next read reloads it
+        store.invalidate(list({entry.account_id for entry in entries} | {LATEST_KEY}))
+        raise
+
+
+def warm_on_startup():
+    """Warm the current state store in the background if STATE_WARM_ON_STARTUP is set"""
+    if not settings.STATE_WARM_ON_STARTUP:
+        return
+    if not settings.STATE_REDIS_URL:
+        logger.warning("Not warming current state: STATE_WARM_ON_STARTUP needs STATE_REDIS_URL")
+        return
+
+    def warm():
+        try:
+            count = get_state_store().warm()
+            logger.info(f"Warmed current state for {count} accounts")
+        except Exception as e:
+            logger.warning(f"Could not warm current state: {e}")
+
+    threading.Thread(target=warm, name='warm-current-state', daemon=True).start()
@@ -1,3 +1,1133 @@
-from django.test import TestCase
+import os
+import json
+import asyncio
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.management import CommandError, call_command
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import views
+from .anomaly import detect, new_state
+from .archive import ARCHIVE_FIELDS, iter_archived_entries, write_archive
+from .load_profile import BIN_COUNT, BIN_RATIO, bin_bounds, bin_index, hour_of_week, quantile
+from .management.commands import compact_history
+from .models import (
+    Anomaly, AnomalyDetectorState, BalanceEntry, DailyUsageRollup, LoadProfile, RechargeEvent
+)
+from .pubsub import LocalBroker
+from .routers import use_primary, use_read_replica
+from .signals import readings_stored
+from .spool import ReadingSpool, flush_spool
+from .state import LATEST_KEY, CurrentStateStore, entry_state, get_state_store
+
+try:
+    # Optional: runs the Redis state store tests against an in-process Redis
+    import fakeredis
+    import lupa  # noqa: F401 (fakeredis needs it for Lua scripts)
+except ImportError:
+    fakeredis = None
+
+import dpdc
+import throttle
+from benchmarks import bench_startup
+
+
+class SpoolTestCase(TestCase):
+    """Base class giving each test an empty spool in a temporary directory"""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.spool = ReadingSpool(os.path.join(self.tmpdir, 'readings.ndjson'))
+        self.start = timezone.now().replace(microsecond=0) - timedelta(hours=10)
+        get_state_store().clear_local()
+
+    def reading(self, hours, balance, account_id='1001'):
+        return {
+            'timestamp': self.start + timedelta(hours=hours),
+            'balance': balance,
+            'account_id': account_id,
+            'customer_name': 'Test',
+            'status': 'Active',
+        }
+
+    def stored(self, account_id='1001'):
+        return list(
+            BalanceEntry.objects.filter(account_id=account_id)
+            .order_by('timestamp').values_list('balance', 'hourly_usage')
+        )
+
+
+class ReadingSpoolTests(SpoolTestCase):
+    def test_flush_writes_readings_and_empties_spool(self):
+        for hours, balance in ((0, 100.0), (1, 98.0), (2, 95.0)):
+            self.spool.append(self.reading(hours, balance))
+
+        count, entries = flush_spool(self.spool)
+
+        self.assertEqual(count, 3)
+        self.assertEqual(len(entries), 3)
+        self.assertEqual(self.stored(), [(100.0, 0), (98.0, 2.0), (95.0, 3.0)])
+        self.assertEqual(self.spool.pending(), 0)
+        self.assertFalse(os.path.exists(self.spool.flushing_path))
+
+    def test_unchanged_balances_are_skipped(self):
+        for hours, balance in ((0, 100.0), (1, 100.0), (2, 97.0), (3, 97.0)):
+            self.spool.append(self.reading(hours, balance))
+        flush_spool(self.spool)
+
+        # The same balance in a later flush is compared with the stored reading
+        self.spool.append(self.reading(4, 97.0))
+        count, entries = flush_spool(self.spool)
+
+        self.assertEqual(count, 1)
+        self.assertEqual(entries, [])
+        self.assertEqual(self.stored(), [(100.0, 0), (97.0, 3.0)])
+
+    def test_leftover_flushing_file_is_replayed(self):
+        # A flusher crashed after claiming these readings
+        self.spool.append(self.reading(0, 100.0))
+        self.spool.append(self.reading(1, 96.0))
+        self.spool.claim()
+        self.spool.append(self.reading(2, 93.0))
+
+        count, _ = flush_spool(self.spool)
+
+        self.assertEqual(count, 3)
+        self.assertEqual(self.stored(), [(100.0, 0), (96.0, 4.0), (93.0, 3.0)])
+        self.assertEqual(self.spool.pending(), 0)
+
+    def test_torn_last_line_is_skipped(self):
+        self.spool.append(self.reading(0, 100.0))
+        with open(self.spool.path, 'a') as f:
+            f.write('{"timestamp": "2024-')
+
+        count, _ = flush_spool(self.spool)
+
+        self.assertEqual(count, 1)
+        self.assertEqual(self.stored(), [(100.0, 0)])
+
+    def test_reflush_after_partial_commit_stores_each_reading_once(self):
+        balances = [100.0, 97.0, 95.0, 90.0]
+        for hours, balance in enumerate(balances):
+            self.spool.append(self.reading(hours, balance))
+
+        # The first batch commits, then the second fails inside its transaction
+        calls = []
+        def fail_second_batch(sender, entries, **kwargs):
+            calls.append(entries)
+            if len(calls) == 2:
+                raise RuntimeError('crash')
+        readings_stored.connect(fail_second_batch, dispatch_uid='fail_second_batch')
+        self.addCleanup(readings_stored.disconnect, dispatch_uid='fail_second_batch')
+
+        with self.assertRaises(RuntimeError):
+            flush_spool(self.spool, batch_size=2)
+        self.assertEqual(self.stored(), [(100.0, 0), (97.0, 3.0)])
+        self.assertTrue(os.path.exists(self.spool.flushing_path))
+
+        readings_stored.disconnect(dispatch_uid='fail_second_batch')
+        count, entries = flush_spool(self.spool, batch_size=2)
+
+        self.assertEqual(count, 4)
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(self.stored(), [(100.0, 0), (97.0, 3.0), (95.0, 2.0), (90.0, 5.0)])
+        self.assertEqual(self.spool.pending(), 0)
+
+    def test_replaying_flushed_readings_adds_nothing(self):
+        self.spool.append(self.reading(0, 100.0))
+        self.spool.append(self.reading(1, 97.0))
+        with open(self.spool.path) as f:
+            lines = f.read()
+        flush_spool(self.spool)
+
+        # The same readings offered again, e.g. a release lost in a crash
+        with open(self.spool.flushing_path, 'w') as f:
+            f.write(lines)
+        count, entries = flush_spool(self.spool)
+
+        self.assertEqual(count, 2)
+        self.assertEqual(entries, [])
+        self.assertEqual(self.stored(), [(100.0, 0), (97.0, 3.0)])
+
+
+class AnalyticsRouterTests(TestCase):
+    """Routing between the primary and the replica alias of settings_test"""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        now = timezone.now()
+        BalanceEntry.objects.using('default').bulk_create([
+            BalanceEntry(timestamp=now, balance=50.0, account_id='primary'),
+        ])
+        # Rows only the replica holds show which alias a read went to
+        BalanceEntry.objects.using('replica').bulk_create([
+            BalanceEntry(timestamp=now, balance=70.0, account_id='replica'),
+        ])
+
+    def accounts(self):
+        return list(BalanceEntry.objects.values_list('account_id', flat=True))
+
+    def test_reads_go_to_primary_by_default(self):
+        self.assertEqual(self.accounts(), ['primary'])
+
+    def test_read_replica_scope_reads_from_replica(self):
+        with use_read_replica():
+            self.assertEqual(self.accounts(), ['replica'])
+        self.assertEqual(self.accounts(), ['primary'])
+
+    def test_reads_after_a_write_stick_to_primary(self):
+        with use_read_replica():
+            BalanceEntry.objects.create(timestamp=timezone.now(), balance=40.0, account_id='written')
+            self.assertCountEqual(self.accounts(), ['primary', 'written'])
+        self.assertFalse(BalanceEntry.objects.using('replica').filter(account_id='written').exists())
+
+    def test_use_primary_inside_replica_scope(self):
+        with use_read_replica():
+            with use_primary():
+                self.assertEqual(self.accounts(), ['primary'])
+            self.assertEqual(self.accounts(), ['replica'])
+
+    def test_usage_views_read_from_replica(self):
+        response = Client().get('/api/usage/history/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['account_id'] for row in response.json()['results']], ['replica'])
+
+    def test_state_store_is_not_filled_from_replica(self):
+        store = get_state_store()
+        store.clear_local()
+        with use_read_replica():
+            state = store.get('replica')
+        self.assertIsNone(state)
+        self.assertEqual(store.get('primary')['balance'], 50.0)
+
+
+class FakeClock:
+    """Stands in for the time module in throttle; sleeping advances the clock"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ThrottleTestCase(SimpleTestCase):
+    """Base class giving each test a fresh file-backed governor state and a fake clock"""
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.store = throttle.FileStateStore(os.path.join(tmpdir, 'throttle.json'))
+        self.clock = FakeClock()
+        patcher = mock.patch.object(throttle, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TokenBucketTests(ThrottleTestCase):
+    def test_burst_then_wait_for_refill(self):
+        bucket = throttle.TokenBucket(self.store, max_rate=2.0, burst=3)
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+        self.clock.now += 0.5
+        self.assertEqual(bucket.try_acquire(), 0)
+
+    def test_state_is_shared_between_processes(self):
+        first = throttle.TokenBucket(self.store, max_rate=1.0, burst=2)
+        second = throttle.TokenBucket(throttle.FileStateStore(self.store.path), max_rate=1.0, burst=2)
+        self.assertEqual(first.try_acquire(), 0)
+        self.assertEqual(second.try_acquire(), 0)
+        self.assertGreater(first.try_acquire(), 0)
+
+    def test_throttling_halves_rate_and_honours_retry_after(self):
+        bucket = throttle.TokenBucket(self.store, max_rate=2.0, min_rate=0.5, burst=3)
+        bucket.on_throttled(retry_after=10)
+        self.assertAlmostEqual(bucket.try_acquire(), 10)
+        self.clock.now += 10
+        # The bucket was drained and refills at the halved rate
+        self.assertAlmostEqual(bucket.try_acquire(), 0)
+        bucket.on_throttled()
+        bucket.on_throttled()
+        with self.store.transaction('bucket') as state:
+            self.assertEqual(state['rate'], 0.5)
+
+    def test_success_raises_rate_up_to_max(self):
+        bucket = throttle.TokenBucket(self.store, max_rate=2.0, burst=3)
+        bucket.on_throttled()
+        bucket.on_success()
+        with self.store.transaction('bucket') as state:
+            self.assertAlmostEqual(state['rate'], 1.1)
+        for _ in range(30):
+            bucket.on_success()
+        with self.store.transaction('bucket') as state:
+            self.assertEqual(state['rate'], 2.0)
+
+
+class CircuitBreakerTests(ThrottleTestCase):
+    def test_opens_after_threshold_and_probes_after_timeout(self):
+        breaker = throttle.CircuitBreaker(self.store, failure_threshold=3, reset_timeout=60)
+        for _ in range(2):
+            breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow_request())
+
+        self.clock.now += 60
+        self.assertTrue(breaker.allow_request())
+        # Only one probe while half-open
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertTrue(breaker.allow_request())
+
+    def test_failed_probe_reopens(self):
+        breaker = throttle.CircuitBreaker(self.store, failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        self.clock.now += 60
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow_request())
+
+    def test_success_resets_failure_count(self):
+        breaker = throttle.CircuitBreaker(self.store, failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.text = json.dumps(body)
+
+    def json(self):
+        if self.body is None:
+            raise ValueError('No JSON')
+        return self.body
+
+
+class DPDCClientErrorTests(ThrottleTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(throttle, '_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_balance(self, response):
+        # Let the bucket refill between requests
+        self.clock.now += 10
+        client = dpdc.DPDCClient(token='token')
+        with mock.patch.object(client.session, 'post', return_value=response):
+            result = client.get_balance('12345678', retry_on_error=False)
+        return client, result
+
+    def test_balance_is_returned(self):
+        details = {'accountId': '1001', 'customerName': 'Test', 'balanceRemaining': 99.5, 'connectionStatus': 'Active'}
+        client, result = self.get_balance(FakeResponse(200, {'data': {'postBalanceDetails': details}}))
+        self.assertEqual(result, details)
+        self.assertIsNone(client.last_error)
+
+    def test_only_auth_failures_need_a_new_token(self):
+        cases = [
+            (FakeResponse(401), dpdc.ERROR_AUTH),
+            (FakeResponse(403), dpdc.ERROR_AUTH),
+            (FakeResponse(200, {'errors': [{'message': 'Invalid token'}]}), dpdc.ERROR_AUTH),
+            (FakeResponse(400), dpdc.ERROR_UPSTREAM),
+            (FakeResponse(404), dpdc.ERROR_UPSTREAM),
+            (FakeResponse(200, {'errors': [{'message': 'Customer not found'}]}), dpdc.ERROR_UPSTREAM),
+            (FakeResponse(408), dpdc.ERROR_SERVER),
+            (FakeResponse(503), dpdc.ERROR_SERVER),
+            (FakeResponse(429), dpdc.ERROR_RATE_LIMITED),
+            (FakeResponse(200, {'errors': [{'message': 'Rate limit exceeded'}]}), dpdc.ERROR_RATE_LIMITED),
+        ]
+        for response, kind in cases:
+            with self.subTest(status=response.status_code, body=response.body):
+                client, result = self.get_balance(response)
+                self.assertIsNone(result)
+                self.assertEqual(client.last_error, kind)
+                self.assertEqual(client.needs_new_token, kind == dpdc.ERROR_AUTH)
+
+    def test_upstream_failures_open_the_breaker(self):
+        with mock.patch.dict(os.environ, {'DPDC_BREAKER_THRESHOLD': '2', 'DPDC_RATE_MAX_WAIT': '0'}):
+            self.get_balance(FakeResponse(503))
+            self.get_balance(FakeResponse(503))
+            client, result = self.get_balance(FakeResponse(200, {'data': None}))
+        self.assertIsNone(result)
+        self.assertEqual(client.last_error, dpdc.ERROR_CIRCUIT_OPEN)
+        self.assertFalse(client.needs_new_token)
+
+
+class StateStoreTestsMixin:
+    """Current state store behaviour shared by the LRU-only and the Redis-backed store"""
+    def setUp(self):
+        self.start = timezone.now().replace(microsecond=0) - timedelta(hours=10)
+        self.store = self.make_store()
+        patcher = mock.patch('electricity_tracker.state._store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def entries(self, account_id, *readings):
+        """Store (hours, balance, hourly_usage) readings for an account"""
+        return BalanceEntry.objects.bulk_create([
+            BalanceEntry(
+                timestamp=self.start + timedelta(hours=hours), balance=balance,
+                hourly_usage=usage, account_id=account_id, status='Active'
+            )
+            for hours, balance, usage in readings
+        ])
+
+    def test_miss_loads_latest_reading_without_totals(self):
+        self.entries('1001', (0, 100.0, 0), (1, 97.0, 3.0))
+
+        state = self.store.get('1001')
+
+        self.assertEqual(state['balance'], 97.0)
+        self.assertNotIn('total_usage', state)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.store.get('1001')['balance'], 97.0)
+
+    def test_applying_entries_twice_does_not_double_count(self):
+        self.entries('1001', (0, 100.0, 0), (1, 97.0, 3.0))
+        self.assertEqual(self.store.warm(), 1)
+        new = self.entries('1001', (2, 95.0, 2.0), (3, 90.0, 5.0))
+
+        self.store.apply_entries(new)
+        self.store.apply_entries(new)
+        self.other_store().apply_entries(new[:1])
+
+        state = self.store.get('1001')
+        self.assertEqual(state['balance'], 90.0)
+        self.assertEqual(state['total_usage'], 10.0)
+        self.assertEqual(state['entry_count'], 4)
+
+    def test_older_state_does_not_replace_newer(self):
+        older, newer = self.entries('1001', (0, 100.0, 0), (1, 97.0, 3.0))
+        self.store.apply_entries([newer])
+
+        # Another process applying a late reading
+        other = self.other_store()
+        other.apply_entries([older])
+        stored = other._put({'1001': entry_state(older)})
+
+        self.assertEqual(stored['1001']['balance'], 97.0)
+        self.assertEqual(self.store.get('1001')['balance'], 97.0)
+        self.assertEqual(other.get('1001')['balance'], 97.0)
+
+    def test_get_latest_follows_the_newest_reading(self):
+        self.entries('1001', (0, 100.0, 0))
+        self.entries('2002', (1, 50.0, 0))
+
+        self.assertEqual(self.store.get_latest()['account_id'], '2002')
+
+        self.store.apply_entries(self.entries('1001', (2, 99.0, 1.0)))
+        with self.assertNumQueries(0):
+            latest = self.store.get_latest()
+        self.assertEqual((latest['account_id'], latest['balance']), ('1001', 99.0))
+
+    def test_failed_state_update_drops_the_state(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        spool = ReadingSpool(os.path.join(tmpdir, 'readings.ndjson'))
+        self.entries('1001', (0, 100.0, 0))
+        self.assertEqual(self.store.get_latest()['balance'], 100.0)
+
+        spool.append({'timestamp': self.start + timedelta(hours=1), 'balance': 97.0, 'account_id': '1001'})
+        with mock.patch.object(self.store, 'apply_entries', side_effect=RuntimeError('state down')):
+            # Post-commit receiver failures are logged, not raised
+            with self.assertLogs('spool', 'ERROR'), self.assertLogs('django.dispatch', 'ERROR'):
+                flush_spool(spool)
+
+        self.assertIsNone(self.store.peek('1001'))
+        self.assertIsNone(self.store.peek(LATEST_KEY))
+        self.assertEqual(self.store.get('1001')['balance'], 97.0)
+
+    def test_latest_view_serves_running_totals(self):
+        DailyUsageRollup.objects.create(
+            account_id='1001', date=timezone.localdate(self.start) - timedelta(days=100),
+            total_usage=40.0, avg_balance=300.0, entry_count=20
+        )
+        self.entries('1001', (0, 100.0, 0), (1, 97.0, 3.0))
+        self.store.warm()
+        self.store.apply_entries(self.entries('1001', (2, 95.0, 2.0)))
+
+        response = Client().get('/api/usage/latest/', {'account_id': '1001'})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['balance'], 95.0)
+        self.assertEqual(data['total_usage'], 45.0)
+        self.assertEqual(data['entry_count'], 23)
+
+
+class LocalStateStoreTests(StateStoreTestsMixin, TestCase):
+    def make_store(self):
+        return CurrentStateStore(ttl=0)
+
+    def other_store(self):
+        # Processes without Redis share nothing, so only this process can race itself
+        return self.store
+
+    def test_latest_view_without_totals(self):
+        self.entries('1001', (0, 100.0, 0))
+
+        data = Client().get('/api/usage/latest/').json()
+
+        self.assertEqual(data['account_id'], '1001')
+        self.assertIsNone(data['total_usage'])
+        self.assertIsNone(data['entry_count'])
+
+    def test_warm_state_needs_redis(self):
+        with self.assertRaises(CommandError):
+            call_command('warm_state')
+
+
+@unittest.skipUnless(fakeredis, 'fakeredis[lua] is not installed')
+class RedisStateStoreTests(StateStoreTestsMixin, TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        super().setUp()
+
+    def make_store(self):
+        """A store with its own LRU sharing this test's Redis, like another process"""
+        client = fakeredis.FakeRedis(server=self.server)
+        with mock.patch('redis.Redis.from_url', return_value=client):
+            return CurrentStateStore(ttl=0, redis_url='redis://state')
+
+    def other_store(self):
+        return self.make_store()
+
+    @override_settings(STATE_REDIS_URL='redis://state')
+    def test_warm_state_fills_redis(self):
+        self.entries('1001', (0, 100.0, 0), (1, 97.0, 3.0))
+        self.entries('2002', (0, 60.0, 0))
+        out = StringIO()
+
+        call_command('warm_state', stdout=out)
+
+        self.assertIn('Warmed current state for 2 accounts', out.getvalue())
+        with self.assertNumQueries(0):
+            state = self.make_store().get('1001')
+        self.assertEqual((state['total_usage'], state['entry_count']), (3.0, 2))
+
+
+def rounded(value, places=6):
+    """Round the floats in a decoded JSON value for comparison"""
+    if isinstance(value, float):
+        return round(value, places)
+    if isinstance(value, list):
+        return [rounded(item, places) for item in value]
+    if isinstance(value, dict):
+        return {key: rounded(item, places) for key, item in value.items()}
+    return value
+
+
+@override_settings(ANALYTICS_DB_ALIAS='default')
+class AnalyticsTestCase(TestCase):
+    """Base class for view tests; usage views read the primary here (see AnalyticsRouterTests)"""
+    def setUp(self):
+        tz = timezone.get_current_timezone()
+        # Local midnight five days ago, so readings fall on whole local days
+        self.start = timezone.make_aware(
+            timezone.datetime.combine(timezone.localdate() - timedelta(days=5), timezone.datetime.min.time()), tz
+        )
+
+    def entries(self, account_id, *readings, customer_name='Test'):
+        """Store (hours, balance, hourly_usage) readings for an account"""
+        return BalanceEntry.objects.bulk_create([
+            BalanceEntry(
+                timestamp=self.start + timedelta(hours=hours), balance=balance, hourly_usage=usage,
+                original_balance=balance, account_id=account_id, customer_name=customer_name, status='Active'
+            )
+            for hours, balance, usage in readings
+        ])
+
+
+class CompactHistoryTests(AnalyticsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.archive = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive)
+        override = override_settings(ARCHIVE_DIR=self.archive)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        # Hourly readings for two accounts over three and a half local days;
+        # keeping three days raw compacts the first two
+        for account_id, rate in (('1001', 0.5), ('2002', 1.25)):
+            self.entries(account_id, *[
+                (hours, 1000.0 - hours * rate, rate * (hours % 3)) for hours in range(0, 3 * 24 + 10)
+            ])
+        self.ids = set(str(pk) for pk in BalanceEntry.objects.values_list('id', flat=True))
+
+    def compact(self, **options):
+        call_command('compact_history', raw_days=3, chunk_size=7, stdout=StringIO(), **options)
+
+    def usage_views(self):
+        urls = ['/api/usage/daily/?days=10', '/api/usage/last30days/']
+        months = {(day.year, day.month) for day in (timezone.localdate(self.start), timezone.localdate())}
+        urls += [f'/api/usage/month/{year}/{month}/' for year, month in sorted(months)]
+        client = Client()
+        return {url: rounded(client.get(url).json()) for url in urls}
+
+    def test_compaction_keeps_usage_view_totals(self):
+        before = self.usage_views()
+
+        self.compact()
+
+        self.assertEqual(DailyUsageRollup.objects.count(), 2 * 2)
+        self.assertFalse(BalanceEntry.objects.filter(timestamp__lt=self.start + timedelta(days=2)).exists())
+        self.assertEqual(self.usage_views(), before)
+
+    def test_rerun_after_interrupted_chunk(self):
+        before = self.usage_views()
+        calls = []
+        def crash_after_third_chunk(*args, **kwargs):
+            path = write_archive(*args, **kwargs)
+            calls.append(path)
+            if len(calls) == 3:
+                raise RuntimeError('killed')
+            return path
+
+        with mock.patch.object(compact_history, 'write_archive', side_effect=crash_after_third_chunk):
+            with self.assertRaises(RuntimeError):
+                self.compact()
+        # Two chunks were committed; the third was archived but rolled back
+        self.assertEqual(BalanceEntry.objects.count(), len(self.ids) - 2 * 7)
+
+        self.compact()
+
+        self.assertEqual(self.usage_views(), before)
+        self.assertEqual(sum(rollup.entry_count for rollup in DailyUsageRollup.objects.all()), 2 * 2 * 24)
+
+    def test_archive_reads_back_each_entry_once(self):
+        self.compact()
+        day = timezone.localdate(self.start)
+        # An interrupted run may archive the same rows again
+        rows = list(iter_archived_entries(day, day))
+        write_archive(day, rows[:10])
+
+        archived = list(iter_archived_entries(day, day))
+
+        self.assertEqual([row['id'] for row in archived], [row['id'] for row in rows])
+        self.assertEqual(len(archived), 2 * 24)
+        self.assertEqual([row['timestamp'] for row in archived], sorted(row['timestamp'] for row in archived))
+        self.assertEqual(len(list(iter_archived_entries(day, day, account_id='1001'))), 24)
+
+    def test_export_includes_archived_entries_once(self):
+        self.compact()
+        day = timezone.localdate(self.start)
+        write_archive(day, list(iter_archived_entries(day, day)))
+        out = StringIO()
+
+        call_command('export_history', stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'id,timestamp,balance,hourly_usage,original_balance,account_id,customer_name,status')
+        exported = [line.split(',')[0] for line in lines[1:]]
+        self.assertEqual(len(exported), len(self.ids))
+        self.assertEqual(set(exported), self.ids)
+
+
+class AccountSummaryTests(AnalyticsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.archive = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive)
+        # Usage over four local days: 1001 and 3003 tie, 2002 uses least
+        for account_id, rate in (('1001', 1.0), ('2002', 0.25), ('3003', 1.0)):
+            self.entries(account_id, *[(hours, 500.0 - hours * rate, rate) for hours in range(0, 4 * 24)])
+
+    def summary(self, **params):
+        response = Client().get('/api/usage/accounts/summary/', {'days': 10, **params})
+        self.assertEqual(response.status_code, 200)
+        return rounded(response.json()['accounts'])
+
+    def compact(self):
+        # Compacts the first two of the four days, inside the summary window
+        call_command('compact_history', raw_days=3, archive_dir=self.archive, stdout=StringIO())
+        self.assertTrue(DailyUsageRollup.objects.exists())
+
+    def test_ranks_accounts_with_ties(self):
+        accounts = self.summary()
+
+        self.assertEqual([(row['rank'], row['account_id']) for row in accounts], [(1, '1001'), (1, '3003'), (3, '2002')])
+        self.assertEqual(accounts[0]['total_usage'], 96.0)
+        self.assertEqual(accounts[0]['entry_count'], 96)
+        self.assertEqual(accounts[0]['last_balance'], 405.0)
+        self.assertEqual(accounts[2]['avg_usage'], 0.25)
+
+    def test_sort_order_and_limit(self):
+        accounts = self.summary(sort='last_balance', order='asc', limit=2)
+
+        self.assertEqual([(row['rank'], row['account_id']) for row in accounts], [(1, '1001'), (1, '3003')])
+
+    def test_compacted_window_ranks_like_raw_entries(self):
+        orderings = [(sort, order) for sort in ('total_usage', 'avg_balance', 'last_balance') for order in ('desc', 'asc')]
+        raw = {ordering: self.summary(sort=ordering[0], order=ordering[1]) for ordering in orderings}
+
+        self.compact()
+
+        with mock.patch.object(views.AccountSummaryAPI, 'merge_rollups', wraps=views.AccountSummaryAPI.merge_rollups) as merge:
+            for sort, order in orderings:
+                with self.subTest(sort=sort, order=order):
+                    self.assertEqual(self.summary(sort=sort, order=order), raw[sort, order])
+        self.assertEqual(merge.call_count, len(orderings))
+
+    def test_nulls_rank_last_in_both_orders(self):
+        self.compact()
+        # An account known only from a rollup without a last balance
+        DailyUsageRollup.objects.create(
+            account_id='4004', date=timezone.localdate(self.start), total_usage=1.0, avg_balance=10.0, entry_count=4
+        )
+
+        for order in ('desc', 'asc'):
+            with self.subTest(order=order):
+                accounts = self.summary(sort='last_balance', order=order)
+                self.assertEqual(accounts[-1]['account_id'], '4004')
+                self.assertEqual(accounts[-1]['rank'], 4)
+                self.assertIsNone(accounts[-1]['last_balance'])
+
+    def test_invalid_parameters(self):
+        for params in ({'days': 'x'}, {'days': 0}, {'limit': 0}, {'limit': 1001}, {'sort': 'balance'}, {'order': 'up'}):
+            with self.subTest(**params):
+                response = Client().get('/api/usage/accounts/summary/', params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_query_count_does_not_grow_with_accounts(self):
+        # One grouped query per source table, plus the check for rollups
+        for compacted, queries in ((False, 2), (True, 3)):
+            if compacted:
+                self.compact()
+            with self.subTest(compacted=compacted):
+                accounts = len(self.summary())
+                for n in range(20):
+                    self.entries(f'new-{queries}-{n}', (95, 100.0, 1.0))
+                with self.assertNumQueries(queries):
+                    self.assertEqual(len(self.summary()), accounts + 20)
+
+
+@override_settings(ANOMALY_WARMUP_READINGS=6, ANOMALY_Z_THRESHOLD=5, RECHARGE_MIN_AMOUNT=50)
+class AnomalyDetectorTests(SimpleTestCase):
+    def setUp(self):
+        self.state = new_state()
+        self.now = timezone.now().replace(microsecond=0) - timedelta(days=2)
+        self.balance = 500.0
+
+    def step(self, change, hours=1):
+        """Feed the reading after the balance changed by change over hours"""
+        self.now += timedelta(hours=hours)
+        self.balance += change
+        return detect(self.state, self.balance, self.now)
+
+    def warm_up(self):
+        # The first reading only sets the baseline
+        self.assertEqual(detect(self.state, self.balance, self.now), [])
+        for rate in (2.0, 3.0, 4.0, 2.0, 3.0, 4.0):
+            self.assertEqual(self.step(-rate), [])
+
+    def test_warmup_readings_seed_median_and_mad(self):
+        self.warm_up()
+
+        self.assertEqual(self.state['n'], 6)
+        self.assertEqual((self.state['median'], self.state['mad']), (3.0, 1.0))
+        self.assertEqual(self.state['warmup'], [])
+
+    def test_spread_of_warmup_is_not_flagged(self):
+        self.warm_up()
+        for rate in (2.0, 4.0, 4.5, 1.5, 3.0) * 4:
+            self.assertEqual(self.step(-rate), [])
+
+    def test_usage_spike(self):
+        self.warm_up()
+
+        found = self.step(-30.0)
+
+        self.assertEqual([anomaly['kind'] for anomaly in found], [Anomaly.USAGE_SPIKE])
+        self.assertEqual(found[0]['value'], 30.0)
+        self.assertEqual(found[0]['expected'], 3.0)
+        self.assertGreater(found[0]['score'], 5)
+        self.assertEqual(self.step(-3.0), [])
+
+    def test_meter_reset(self):
+        self.warm_up()
+
+        found = self.step(-self.balance)
+
+        self.assertEqual([anomaly['kind'] for anomaly in found], [Anomaly.METER_RESET])
+
+    def test_small_balance_jump(self):
+        self.warm_up()
+
+        found = self.step(10.0)
+        recharge = self.step(500.0)
+
+        self.assertEqual([(anomaly['kind'], anomaly['value']) for anomaly in found], [(Anomaly.BALANCE_JUMP, 10.0)])
+        self.assertEqual(recharge, [])
+
+    def test_late_reading_is_skipped(self):
+        self.warm_up()
+        before = json.loads(json.dumps(self.state))
+
+        found = detect(self.state, 0.0, self.now - timedelta(minutes=30))
+        repeated = detect(self.state, 0.0, self.now)
+
+        self.assertEqual((found, repeated), ([], []))
+        self.assertEqual(self.state, before)
+
+    def test_rate_is_per_hour(self):
+        self.warm_up()
+
+        # Thirty Taka over ten hours is a normal rate, over one hour a spike
+        self.assertEqual(self.step(-30.0, hours=10), [])
+        self.assertEqual(len(self.step(-30.0, hours=1)), 1)
+
+
+@override_settings(ANOMALY_WARMUP_READINGS=6, ANOMALY_Z_THRESHOLD=5, RECHARGE_MIN_AMOUNT=50)
+class AnomalyReplayTests(SpoolTestCase):
+    def test_replay_finds_the_same_anomalies_as_ingest(self):
+        changes = [-2.0, -3.0, -4.0, -2.0, -3.0, -4.0, -3.0, -30.0, -3.0, 10.0, -2.0, -3.0, 500.0, -4.0, -3.0]
+        balance = 100.0
+        self.spool.append(self.reading(0, balance))
+        for hours, change in enumerate(changes, 1):
+            balance += change
+            self.spool.append(self.reading(hours, balance))
+        self.spool.append(self.reading(len(changes) + 1, 0.0))
+        self.spool.append(self.reading(0, 300.0, account_id='2002'))
+        self.spool.append(self.reading(1, 310.0, account_id='2002'))
+
+        # Live ingest sees the readings in several batches
+        flush_spool(self.spool, batch_size=4)
+        live = list(Anomaly.objects.order_by('account_id', 'timestamp').values_list('account_id', 'kind', 'value', 'entry'))
+        live_states = {row.account_id: row.state for row in AnomalyDetectorState.objects.all()}
+
+        call_command('detect_anomalies', replay=True, skip_archive=True, stdout=StringIO())
+
+        replayed = list(Anomaly.objects.order_by('account_id', 'timestamp').values_list('account_id', 'kind', 'value', 'entry'))
+        self.assertEqual([(account, kind) for account, kind, _, _ in live], [
+            ('1001', Anomaly.USAGE_SPIKE), ('1001', Anomaly.BALANCE_JUMP), ('1001', Anomaly.METER_RESET),
+            ('2002', Anomaly.BALANCE_JUMP),
+        ])
+        self.assertEqual(replayed, live)
+        self.assertEqual({row.account_id: row.state for row in AnomalyDetectorState.objects.all()}, live_states)
+
+    def test_replay_needs_the_flag(self):
+        with self.assertRaises(CommandError):
+            call_command('detect_anomalies')
+
+
+@override_settings(ANALYTICS_DB_ALIAS='default', RECHARGE_MIN_AMOUNT=50)
+class RechargeTests(SpoolTestCase):
+    def ingest(self, *balances, account_id='1001', start_hour=0, batch_size=None):
+        for hours, balance in enumerate(balances, start_hour):
+            self.spool.append(self.reading(hours, balance, account_id))
+        flush_spool(self.spool, batch_size=batch_size)
+
+    def recharges(self):
+        return list(
+            RechargeEvent.objects.order_by('account_id', 'timestamp')
+            .values_list('account_id', 'amount', 'balance_before', 'balance_after', 'entry__balance')
+        )
+
+    def test_rise_of_at_least_min_amount_is_a_recharge(self):
+        self.ingest(100.0, 149.99, 140.0, 190.0)
+
+        self.assertEqual(self.recharges(), [('1001', 50.0, 140.0, 190.0, 190.0)])
+
+    def test_recharge_spanning_two_batches(self):
+        self.ingest(100.0, 95.0, 300.0, 290.0, batch_size=2)
+        # The previous reading of a later flush comes from the database
+        self.ingest(280.0, 480.0, start_hour=4)
+
+        self.assertEqual(self.recharges(), [
+            ('1001', 205.0, 95.0, 300.0, 300.0), ('1001', 200.0, 280.0, 480.0, 480.0)
+        ])
+
+    def test_backfill_is_idempotent(self):
+        self.ingest(100.0, 90.0, 200.0, 190.0)
+        self.ingest(50.0, 40.0, 140.0, account_id='2002')
+        self.ingest(400.0, 350.0, 300.0, 500.0, start_hour=4)
+        live = self.recharges()
+        RechargeEvent.objects.all().delete()
+
+        # Compact the first account's first readings into the archive
+        archive = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive)
+        archived = BalanceEntry.objects.filter(account_id='1001', timestamp__lt=self.start + timedelta(hours=4))
+        with override_settings(ARCHIVE_DIR=archive):
+            write_archive(timezone.localdate(self.start), list(archived.order_by('timestamp').values(*ARCHIVE_FIELDS)))
+            archived.delete()
+            for _ in range(2):
+                call_command('backfill_recharges', stdout=StringIO())
+
+        self.assertEqual(
+            [row[:4] for row in self.recharges()],
+            [row[:4] for row in live]
+        )
+        self.assertEqual(RechargeEvent.objects.filter(account_id='1001', entry__isnull=True).count(), 1)
+
+    def test_spent_since_last_recharge(self):
+        self.ingest(100.0, 90.0, 300.0, 280.0, 250.0)
+        self.ingest(60.0, 55.0, account_id='2002')
+
+        response = Client().get('/api/usage/recharges/since-last/', {'account_id': '1001'})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['current_balance'], 250.0)
+        self.assertEqual(data['spent'], 50.0)
+        self.assertEqual(data['recharge']['amount'], 210.0)
+        self.assertAlmostEqual(data['days_since_recharge'], 2 / 24)
+        self.assertAlmostEqual(data['avg_daily_spend'], 50.0 * 12)
+
+    def test_spent_since_last_recharge_not_found(self):
+        client = Client()
+        self.assertEqual(client.get('/api/usage/recharges/since-last/').status_code, 404)
+
+        self.ingest(100.0, 90.0)
+        for params in ({}, {'account_id': '1001'}, {'account_id': 'unknown'}):
+            with self.subTest(**params):
+                response = client.get('/api/usage/recharges/since-last/', params)
+                self.assertEqual(response.status_code, 404)
+
+
+class LoadProfileHelperTests(SimpleTestCase):
+    def test_hour_of_week_is_local_dhaka_time(self):
+        utc = dt_timezone.utc
+        # Dhaka is UTC+6: Sunday 17:59 UTC is Sunday 23:59, 18:00 UTC is Monday 00:00
+        self.assertEqual(hour_of_week(datetime(2024, 1, 7, 17, 59, tzinfo=utc)), 6 * 24 + 23)
+        self.assertEqual(hour_of_week(datetime(2024, 1, 7, 18, 0, tzinfo=utc)), 0)
+        self.assertEqual(hour_of_week(datetime(2024, 1, 10, 6, 30, tzinfo=utc)), 2 * 24 + 12)
+
+    def test_bin_index_matches_bin_bounds(self):
+        self.assertEqual(bin_index(0.0), 0)
+        self.assertEqual(bin_index(0.049), 0)
+        self.assertEqual(bin_index(0.05), 1)
+        self.assertEqual(bin_index(1e6), BIN_COUNT - 1)
+        for value in (0.051, 0.07, 0.3, 1.0, 2.5, 7.0, 20.0, 100.0):
+            with self.subTest(value=value):
+                lower, upper = bin_bounds(bin_index(value))
+                self.assertLessEqual(lower, value)
+                self.assertLess(value, upper)
+
+    def test_quantile(self):
+        self.assertIsNone(quantile([0] * BIN_COUNT, 0.5))
+
+        histogram = [0] * BIN_COUNT
+        histogram[bin_index(1.0)] = 10
+        lower, upper = bin_bounds(bin_index(1.0))
+        self.assertAlmostEqual(quantile(histogram, 0.5), (lower + upper) / 2)
+
+        histogram[bin_index(5.0)] = 10
+        p10, p50, p90 = (quantile(histogram, q) for q in (0.1, 0.5, 0.9))
+        self.assertLess(p10, 1.0 * BIN_RATIO)
+        self.assertLessEqual(p10, p50)
+        self.assertGreater(p90, 5.0 / BIN_RATIO)
+
+
+@override_settings(ANALYTICS_DB_ALIAS='default')
+class LoadProfileTests(SpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        # Sunday 22:00 in Dhaka
+        self.start = datetime(2024, 1, 7, 16, 0, tzinfo=dt_timezone.utc)
+
+    def ingest(self, hours, account_id='1001', batch_size=None):
+        """Flush hourly readings using 1 to 4 Taka an hour, depending on the hour"""
+        balance = 1000.0
+        for hour in hours:
+            balance -= 1 + hour % 4
+            self.spool.append(self.reading(hour, balance, account_id))
+        flush_spool(self.spool, batch_size=batch_size)
+
+    def profiles(self):
+        return {
+            profile.account_id: (profile.counts, rounded(profile.sums), profile.histograms)
+            for profile in LoadProfile.objects.all()
+        }
+
+    def test_incremental_profile_equals_rebuilt_profile(self):
+        self.ingest(range(0, 30), batch_size=7)
+        self.ingest(range(40, 60), batch_size=7)
+        self.ingest(range(0, 20), account_id='2002')
+        incremental = self.profiles()
+
+        # Compaction interrupted after archiving, so some rows are archived and stored
+        archive = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive)
+        old = BalanceEntry.objects.filter(timestamp__lt=self.start + timedelta(hours=20)).order_by('timestamp')
+        with override_settings(ARCHIVE_DIR=archive):
+            write_archive(timezone.localdate(self.start), list(old.values(*ARCHIVE_FIELDS)))
+            BalanceEntry.objects.filter(pk__in=list(old.values_list('pk', flat=True)[:10])).delete()
+            LoadProfile.objects.all().delete()
+            call_command('rebuild_load_profiles', stdout=StringIO())
+
+        self.assertEqual(self.profiles(), incremental)
+
+    def test_readings_land_in_local_weekday_and_hour(self):
+        # 16:00 UTC Sunday is 22:00 Sunday in Dhaka; the second reading has the first usage
+        self.ingest(range(0, 4))
+
+        data = Client().get('/api/usage/profile/', {'account_id': '1001'}).json()
+
+        self.assertEqual(data['weekdays'][6], 'Sun')
+        self.assertEqual(data['counts'][6][23], 1)
+        self.assertEqual(data['counts'][0][:2], [1, 1])
+        self.assertEqual(data['mean_usage'][6][23], 2.0)
+        self.assertEqual(data['mean_usage'][0][:2], [3.0, 4.0])
+        self.assertEqual(sum(map(sum, data['counts'])), 3)
+
+    def test_profile_not_found(self):
+        self.assertEqual(Client().get('/api/usage/profile/').status_code, 404)
+        self.ingest(range(0, 3))
+        self.assertEqual(Client().get('/api/usage/profile/', {'account_id': 'unknown'}).status_code, 404)
+        self.assertEqual(Client().get('/api/usage/profile/').json()['account_id'], '1001')
+
+
+@override_settings(SSE_HEARTBEAT_SECONDS=1, SSE_MAX_SECONDS=30)
+class BalanceStreamTests(SpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.broker = LocalBroker()
+        for target, value in (('electricity_tracker.pubsub._broker', self.broker),
+                              ('electricity_tracker.state._store', CurrentStateStore(ttl=0))):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.spool.append(self.reading(0, 100.0))
+        self.spool.append(self.reading(0.5, 60.0, account_id='2002'))
+        flush_spool(self.spool)
+
+    async def flush(self, *readings):
+        for reading in readings:
+            self.spool.append(reading)
+        await sync_to_async(flush_spool)(self.spool)
+
+    async def open_stream(self, **params):
+        """Start reading a stream; return its response, a queue of its balance events and the reader task"""
+        response = await AsyncClient().get('/api/usage/stream/', params)
+        events = asyncio.Queue()
+
+        async def read():
+            async for chunk in response.streaming_content:
+                for line in chunk.decode().splitlines():
+                    if line.startswith('data: '):
+                        events.put_nowait(json.loads(line[len('data: '):]))
+
+        return response, events, asyncio.create_task(read())
+
+    async def next_event(self, events):
+        return await asyncio.wait_for(events.get(), timeout=5)
+
+    async def disconnect(self, reader):
+        # A disconnected client's response is abandoned mid-stream
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+
+    async def test_stream_sends_latest_then_new_readings(self):
+        response, events, reader = await self.open_stream(account_id='1001')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        first = await self.next_event(events)
+        self.assertEqual((first['account_id'], first['balance']), ('1001', 100.0))
+        self.assertEqual(self.broker.subscriber_count(), 1)
+
+        # Another account's reading is filtered out
+        await self.flush(self.reading(1, 55.0, account_id='2002'), self.reading(1, 97.0))
+        new = await self.next_event(events)
+        self.assertEqual((new['account_id'], new['balance'], new['hourly_usage']), ('1001', 97.0, 3.0))
+
+        await self.disconnect(reader)
+        self.assertTrue(events.empty())
+        self.assertEqual(self.broker.subscriber_count(), 0)
+
+    async def test_stream_of_all_accounts(self):
+        _, events, reader = await self.open_stream()
+        self.assertEqual((await self.next_event(events))['account_id'], '2002')
+
+        await self.flush(self.reading(1, 95.0), self.reading(2, 50.0, account_id='2002'))
+
+        self.assertEqual([(await self.next_event(events))['account_id'] for _ in range(2)], ['1001', '2002'])
+        await self.disconnect(reader)
+        self.assertEqual(self.broker.subscriber_count(), 0)
+
+    @override_settings(SSE_MAX_SECONDS=1)
+    async def test_stream_ends_after_max_seconds(self):
+        response = await AsyncClient().get('/api/usage/stream/', {'account_id': '1001'})
+
+        chunks = [chunk.decode() async for chunk in response.streaming_content]
+
+        self.assertEqual(chunks[0], 'retry: 5000\n\n')
+        self.assertIn('event: balance', chunks[1])
+        self.assertEqual(self.broker.subscriber_count(), 0)
+
+    async def test_latest_balance_view(self):
+        client = AsyncClient()
+
+        latest = await client.get('/api/usage/latest/')
+        account = await client.get('/api/usage/latest/', {'account_id': '1001'})
+        unknown = await client.get('/api/usage/latest/', {'account_id': 'unknown'})
+
+        self.assertEqual(latest.json()['account_id'], '2002')
+        self.assertEqual(account.json()['balance'], 100.0)
+        self.assertEqual(unknown.status_code, 404)
+
+
+FETCH_IMPORTS_SCRIPT = '''
+import json, os, runpy, sys
+sys.path.insert(0, {project_dir!r})
+sys.argv = ['manage.py', 'fetch_balance', '--customer', 'BENCH-1']
+try:
+    runpy.run_path({manage!r}, run_name='__main__')
+finally:
+    heavy = [
+        module for module in ('playwright', 'rest_framework', 'django.contrib.admin')
+        if any(name == module or name.startswith(module + '.') for name in sys.modules)
+    ]
+    print(json.dumps({{'settings': os.environ.get('DJANGO_SETTINGS_MODULE'), 'heavy': heavy}}))
+'''
+
+
+class FetchStartupTests(SimpleTestCase):
+    """The cron fetch path, run in a fresh interpreter as cron would"""
+    def test_cached_token_fetch_skips_heavy_imports(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), bench_startup.StubDPDCHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        with open(os.path.join(workdir, 'auth_token.txt'), 'w') as f:
+            f.write('test-token')
+        port = server.server_address[1]
+        subprocess.run(
+            [sys.executable, bench_startup.MANAGE, 'migrate', '-v', '0'],
+            cwd=workdir, env=bench_startup.bench_env(workdir, port, 'dpdc_tracker.settings'), check=True,
+        )
+
+        # No DJANGO_SETTINGS_MODULE: manage.py picks the fetch settings itself
+        script = FETCH_IMPORTS_SCRIPT.format(project_dir=bench_startup.PROJECT_DIR, manage=bench_startup.MANAGE)
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=workdir, env=bench_startup.bench_env(workdir, port, None),
+            capture_output=True, text=True, timeout=60,
+        )
+
+        self.assertIn('Balance changed', result.stdout, result.stderr)
+        loaded = json.loads(result.stdout.splitlines()[-1])
+        self.assertEqual(loaded['settings'], 'dpdc_tracker.settings_fetch')
+        self.assertEqual(loaded['heavy'], [])
@@ -1,15 +1,22 @@
 from django.urls import path
 from .views import (
-    LatestBalanceAPI,
+    LatestBalanceView,
+    BalanceStreamView,
     BalanceHistoryAPI,
     DailyUsageAPI,
     Last30DaysUsageAPI,
     MonthlyUsageAPI,
-    YearlyUsageAPI
+    YearlyUsageAPI,
+    AccountSummaryAPI,
+    LoadProfileAPI,
+    AnomalyListAPI,
+    RechargeHistoryAPI,
+    SpentSinceRechargeAPI
 )
 
 urlpatterns = [
-    path('latest/', LatestBalanceAPI.as_view(), name='latest_balance'),
+    path('latest/', LatestBalanceView.as_view(), name='latest_balance'),
+    path('stream/', BalanceStreamView.as_view(), name='balance_stream'),
     path('history/', BalanceHistoryAPI.as_view(), name='balance_history'),
     path('daily/', DailyUsageAPI.as_view(), name='daily_usage'),
     path('last30days/', Last30DaysUsageAPI.as_view(), name='last_30_days_usage'),
@@ -17,4 +24,9 @@ urlpatterns = [
     path('month/', MonthlyUsageAPI.as_view(), name='current_month_usage'),
     path('year/<int:year>/', YearlyUsageAPI.as_view(), name='yearly_usage'),
     path('year/', YearlyUsageAPI.as_view(), name='current_year_usage'),
+    path('accounts/summary/', AccountSummaryAPI.as_view(), name='account_summary'),
+    path('profile/', LoadProfileAPI.as_view(), name='load_profile'),
+    path('anomalies/', AnomalyListAPI.as_view(), name='anomalies'),
+    path('recharges/', RechargeHistoryAPI.as_view(), name='recharge_history'),
+    path('recharges/since-last/', SpentSinceRechargeAPI.as_view(), name='spent_since_recharge'),
 ]
\ No newline at end of file
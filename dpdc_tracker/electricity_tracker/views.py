@@ -1,23 +1,128 @@
+import json
+import asyncio
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics
-from django.db.models import Sum, Avg, Count
-from django.db.models.functions import TruncDate, TruncMonth, TruncYear
+from django.db.models import Sum, Avg, Count, F, Max, OuterRef, Subquery, Window
+from django.db.models.functions import Rank, TruncDate, TruncMonth, TruncYear
 from django.utils import timezone
 from datetime import datetime, timedelta
-from .models import BalanceEntry
-from .serializers import BalanceEntrySerializer, DailyUsageSerializer, MonthlyUsageSerializer
+from .models import BalanceEntry, DailyUsageRollup, LoadProfile, Anomaly, RechargeEvent
+from .serializers import (
+    BalanceEntrySerializer, DailyUsageSerializer, MonthlyUsageSerializer, AccountSummarySerializer,
+    AnomalySerializer, RechargeEventSerializer
+)
+from .routers import use_read_replica
+from .pubsub import get_broker
+from .state import get_state_store
+from .load_profile import profile_summary
+from asgiref.sync import sync_to_async
 
-class LatestBalanceAPI(APIView):
-    """API endpoint to get the latest balance entry"""
-    def get(self, request):
-        latest_entry = BalanceEntry.objects.order_by('-timestamp').first()
+class ReadReplicaMixin:
+    """Serve the view's queries from the analytics read alias"""
+    def dispatch(self, request, *args, **kwargs):
+        with use_read_replica():
+            return super().dispatch(request, *args, **kwargs)
+
+def merge_daily_rollups(daily_rows, start_date, end_date=None, usage_key='total_usage',
+                        with_balance=False, descending=False):
+    """Add compacted daily rollups to per-day rows aggregated from raw entries"""
+    rollups = DailyUsageRollup.objects.filter(date__gte=timezone.localdate(start_date))
+    if end_date is not None:
+        rollups = rollups.filter(date__lt=timezone.localdate(end_date))
+    rollups = rollups.values('date').annotate(
+        usage=Sum('total_usage'),
+        balance_total=Sum(F('avg_balance') * F('entry_count')),
+        entries=Sum('entry_count')
+    )
+
+    merged = {row['date']: dict(row) for row in daily_rows}
+    for rollup in rollups:
+        row = merged.setdefault(rollup['date'], {'date': rollup['date'], usage_key: 0.0})
+        row[usage_key] = (row[usage_key] or 0.0) + rollup['usage']
+        if with_balance:
+            raw_count = row.get('entry_count', 0)
+            count = raw_count + rollup['entries']
+            row['avg_balance'] = ((row.get('avg_balance') or 0.0) * raw_count + rollup['balance_total']) / count
+            row['entry_count'] = count
+    return sorted(merged.values(), key=lambda row: row['date'], reverse=descending)
+
+async def current_state(account_id=None, with_totals=False):
+    """Latest entry fields for an account (or the most recent account), or None"""
+    store = get_state_store()
+    state = store.get_local(account_id) if account_id else store.get_latest_local()
+    if state is None:
+        # Not cached in this process: try Redis, then the database
+        if account_id:
+            state = await sync_to_async(store.get)(account_id)
+        else:
+            state = await sync_to_async(store.get_latest)()
+    if state is None:
+        return None
+    latest_entry = {field: state[field] for field in BalanceEntrySerializer.Meta.fields}
+    if with_totals:
+        # Only states warmed into Redis carry running totals; None otherwise
+        latest_entry['total_usage'] = state.get('total_usage')
+        latest_entry['entry_count'] = state.get('entry_count')
+    return latest_entry
+
+class LatestBalanceView(View):
+    """
+    Async endpoint to get the latest balance entry, optionally for one account,
+    with the account's running total_usage and entry_count when known
+    """
+    async def get(self, request):
+        latest_entry = await current_state(request.GET.get('account_id'), with_totals=True)
         if latest_entry:
-            serializer = BalanceEntrySerializer(latest_entry)
-            return Response(serializer.data)
-        return Response({"error": "No balance data available"}, status=status.HTTP_404_NOT_FOUND)
+            return JsonResponse(latest_entry)
+        return JsonResponse({"error": "No balance data available"}, status=status.HTTP_404_NOT_FOUND)
+
+class BalanceStreamView(View):
+    """
+    Server-sent events stream of new balance entries, optionally for one account.
 
-class BalanceHistoryAPI(generics.ListAPIView):
+    Sends the latest entry on connect, then each new entry as it is ingested.
+    Streams end after SSE_MAX_SECONDS and the client's EventSource reconnects,
+    which bounds how long a subscriber of a vanished client can linger.
+    """
+    async def get(self, request):
+        account_id = request.GET.get('account_id')
+        response = StreamingHttpResponse(self.events(account_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+        return response
+
+    @staticmethod
+    def format_event(payload):
+        return f"id: {payload['id']}\nevent: balance\ndata: {json.dumps(payload)}\n\n"
+
+    async def events(self, account_id):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.SSE_MAX_SECONDS
+        async with get_broker().subscribe(account_id) as queue:
+            yield "retry: 5000\n\n"
+
+            latest_entry = await current_state(account_id)
+            if latest_entry:
+                yield self.format_event(latest_entry)
+
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    payload = await asyncio.wait_for(
+                        queue.get(), timeout=min(settings.SSE_HEARTBEAT_SECONDS, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield self.format_event(payload)
+
+class BalanceHistoryAPI(ReadReplicaMixin, generics.ListAPIView):
     """API endpoint to get balance history with pagination"""
     serializer_class = BalanceEntrySerializer
     
@@ -32,7 +137,7 @@ class BalanceHistoryAPI(generics.ListAPIView):
         except ValueError:
             return BalanceEntry.objects.all()[:100]  # Default limit
 
-class DailyUsageAPI(APIView):
+class DailyUsageAPI(ReadReplicaMixin, APIView):
     """API endpoint to get daily usage summary"""
     def get(self, request):
         days = self.request.query_params.get('days', 30)
@@ -52,6 +157,7 @@ class DailyUsageAPI(APIView):
                 avg_balance=Avg('balance'),
                 entry_count=Count('id')
             ).order_by('-date')
+            daily_data = merge_daily_rollups(daily_data, start_date, with_balance=True, descending=True)
             
             serializer = DailyUsageSerializer(daily_data, many=True)
             return Response(serializer.data)
@@ -61,7 +167,7 @@ class DailyUsageAPI(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-class Last30DaysUsageAPI(APIView):
+class Last30DaysUsageAPI(ReadReplicaMixin, APIView):
     """API endpoint to get the last 30 days usage summary"""
     def get(self, request):
         thirty_days_ago = timezone.now() - timezone.timedelta(days=30)
@@ -71,7 +177,7 @@ class Last30DaysUsageAPI(APIView):
             timestamp__gte=thirty_days_ago
         ).aggregate(
             total=Sum('hourly_usage'),
-            avg_daily=Avg('hourly_usage') * 24  # Estimate daily average
+            count=Count('id')
         )
         
         # Get daily breakdown
@@ -82,16 +188,215 @@ class Last30DaysUsageAPI(APIView):
         ).values('date').annotate(
             total_usage=Sum('hourly_usage')
         ).order_by('-date')[:30]
+        daily_breakdown = merge_daily_rollups(daily_breakdown, thirty_days_ago, descending=True)[:30]
+        compacted = DailyUsageRollup.objects.filter(
+            date__gte=timezone.localdate(thirty_days_ago)
+        ).aggregate(total=Sum('total_usage'), count=Sum('entry_count'))
+        total_usage = (total['total'] or 0.0) + (compacted['total'] or 0.0)
+        entry_count = total['count'] + (compacted['count'] or 0)
         
         result = {
-            'total_usage': total['total'] or 0.0,
-            'avg_daily_usage': total['avg_daily'] or 0.0,
+            'total_usage': total_usage,
+            # Estimate daily average from the average usage per reading
+            'avg_daily_usage': total_usage / entry_count * 24 if entry_count else 0.0,
             'daily_breakdown': list(daily_breakdown)
         }
         
         return Response(result)
 
-class MonthlyUsageAPI(APIView):
+class AccountSummaryAPI(ReadReplicaMixin, APIView):
+    """
+    API endpoint ranking accounts by usage over the last `days` days.
+
+    Query parameters: days (default 30), sort (total_usage, avg_usage,
+    avg_balance, entry_count or last_balance), order (desc or asc) and
+    limit (top N, default 100). Computed with one grouped query per source
+    table, never one query per account.
+    """
+    SORT_FIELDS = ('total_usage', 'avg_usage', 'avg_balance', 'entry_count', 'last_balance')
+    MAX_LIMIT = 1000
+
+    def get(self, request):
+        try:
+            days = int(request.query_params.get('days', 30))
+            limit = int(request.query_params.get('limit', 100))
+        except ValueError:
+            return Response(
+                {"error": "days and limit must be integers"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        sort = request.query_params.get('sort', 'total_usage')
+        order = request.query_params.get('order', 'desc')
+        if days < 1 or not 1 <= limit <= self.MAX_LIMIT:
+            return Response(
+                {"error": f"days must be positive and limit between 1 and {self.MAX_LIMIT}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if sort not in self.SORT_FIELDS or order not in ('desc', 'asc'):
+            return Response(
+                {"error": f"sort must be one of {', '.join(self.SORT_FIELDS)} and order desc or asc"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        start_date = timezone.now() - timedelta(days=days)
+        entries = BalanceEntry.objects.filter(timestamp__gte=start_date, account_id__isnull=False)
+        last_balance = entries.filter(
+            account_id=OuterRef('account_id')
+        ).order_by('-timestamp').values('balance')[:1]
+        summary = entries.values('account_id').annotate(
+            customer_name=Max('customer_name'),
+            total_usage=Sum('hourly_usage'),
+            avg_usage=Avg('hourly_usage'),
+            avg_balance=Avg('balance'),
+            entry_count=Count('id'),
+            last_reading=Max('timestamp'),
+            last_balance=Subquery(last_balance)
+        )
+
+        rollups = DailyUsageRollup.objects.filter(
+            date__gte=timezone.localdate(start_date), account_id__isnull=False
+        )
+        if rollups.exists():
+            # Part of the window has been compacted: merge and rank in Python
+            accounts = self.merge_rollups(list(summary), rollups, sort, order)[:limit]
+        else:
+            sort_expression = F(sort).desc(nulls_last=True) if order == 'desc' else F(sort).asc(nulls_last=True)
+            accounts = summary.annotate(
+                rank=Window(expression=Rank(), order_by=sort_expression)
+            ).order_by('rank', 'account_id')[:limit]
+
+        serializer = AccountSummarySerializer(accounts, many=True)
+        return Response({
+            'days': days,
+            'sort': sort,
+            'order': order,
+            'accounts': serializer.data
+        })
+
+    @staticmethod
+    def merge_rollups(rows, rollups, sort, order):
+        """Fold per-account rollup totals into raw summary rows and rank them"""
+        merged = {row['account_id']: dict(row) for row in rows}
+        rollup_totals = rollups.values('account_id').annotate(
+            usage=Sum('total_usage'),
+            balance_total=Sum(F('avg_balance') * F('entry_count')),
+            entries=Sum('entry_count'),
+            last_reading=Max('last_timestamp'),
+            last_balance=Subquery(
+                rollups.filter(account_id=OuterRef('account_id')).order_by('-date').values('last_balance')[:1]
+            )
+        )
+        for rollup in rollup_totals:
+            row = merged.setdefault(rollup['account_id'], {
+                'account_id': rollup['account_id'], 'customer_name': None, 'total_usage': 0.0,
+                'avg_balance': 0.0, 'entry_count': 0, 'last_reading': None, 'last_balance': None
+            })
+            count = row['entry_count'] + rollup['entries']
+            row['avg_balance'] = (row['avg_balance'] * row['entry_count'] + rollup['balance_total']) / count
+            row['total_usage'] = (row['total_usage'] or 0.0) + rollup['usage']
+            row['entry_count'] = count
+            row['avg_usage'] = row['total_usage'] / count
+            if row['last_reading'] is None:
+                row['last_reading'] = rollup['last_reading']
+                row['last_balance'] = rollup['last_balance']
+
+        # Nulls sort last in both directions, as in the SQL path
+        sign = -1 if order == 'desc' else 1
+        present = sorted(
+            (row for row in merged.values() if row[sort] is not None),
+            key=lambda row: (sign * row[sort], row['account_id'])
+        )
+        ranked = present + [row for row in merged.values() if row[sort] is None]
+        previous = None
+        for position, row in enumerate(ranked, 1):
+            row['rank'] = previous['rank'] if previous and previous[sort] == row[sort] else position
+            previous = row
+        return ranked
+
+def latest_reading(account_id=None):
+    """
+    Latest account_id, balance and timestamp of an account (or of the most
+    recent account) from one indexed query, or None. Used by replica-routed
+    views instead of the current state store, which they must not fill.
+    """
+    entries = BalanceEntry.objects.all()
+    if account_id:
+        entries = entries.filter(account_id=account_id)
+    return entries.order_by('-timestamp').values('account_id', 'balance', 'timestamp').first()
+
+class LoadProfileAPI(ReadReplicaMixin, APIView):
+    """API endpoint for an account's hour-of-week usage heatmap and percentile bands"""
+    def get(self, request):
+        account_id = request.query_params.get('account_id')
+        if not account_id:
+            latest = latest_reading()
+            account_id = latest['account_id'] if latest else None
+        profile = LoadProfile.objects.filter(account_id=account_id).first() if account_id else None
+        if profile is None:
+            return Response({"error": "No load profile available"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(profile_summary(profile))
+
+class AnomalyListAPI(ReadReplicaMixin, generics.ListAPIView):
+    """API endpoint listing detected anomalies, filterable by account_id, kind and days"""
+    serializer_class = AnomalySerializer
+    
+    def get_queryset(self):
+        anomalies = Anomaly.objects.all()
+        account_id = self.request.query_params.get('account_id')
+        if account_id:
+            anomalies = anomalies.filter(account_id=account_id)
+        kind = self.request.query_params.get('kind')
+        if kind:
+            anomalies = anomalies.filter(kind=kind)
+        try:
+            days = int(self.request.query_params.get('days', 30))
+            if days < 1:
+                days = 30
+        except ValueError:
+            days = 30
+        return anomalies.filter(timestamp__gte=timezone.now() - timedelta(days=days))
+
+class RechargeHistoryAPI(ReadReplicaMixin, generics.ListAPIView):
+    """API endpoint listing recharges, newest first, filterable by account_id and days"""
+    serializer_class = RechargeEventSerializer
+    
+    def get_queryset(self):
+        recharges = RechargeEvent.objects.all()
+        account_id = self.request.query_params.get('account_id')
+        if account_id:
+            recharges = recharges.filter(account_id=account_id)
+        days = self.request.query_params.get('days')
+        if days:
+            try:
+                recharges = recharges.filter(timestamp__gte=timezone.now() - timedelta(days=int(days)))
+            except ValueError:
+                pass
+        return recharges
+
+class SpentSinceRechargeAPI(ReadReplicaMixin, APIView):
+    """API endpoint for the amount spent since an account's last recharge"""
+    def get(self, request):
+        current = latest_reading(request.query_params.get('account_id'))
+        if current is None:
+            return Response({"error": "No balance data available"}, status=status.HTTP_404_NOT_FOUND)
+        
+        recharge = RechargeEvent.objects.filter(account_id=current['account_id']).order_by('-timestamp').first()
+        if recharge is None:
+            return Response({"error": "No recharge recorded for this account"}, status=status.HTTP_404_NOT_FOUND)
+        
+        spent = max(0.0, recharge.balance_after - current['balance'])
+        days = (current['timestamp'] - recharge.timestamp).total_seconds() / 86400
+        return Response({
+            'account_id': current['account_id'],
+            'recharge': RechargeEventSerializer(recharge).data,
+            'current_balance': current['balance'],
+            'last_reading': timezone.localtime(current['timestamp']),
+            'spent': spent,
+            'days_since_recharge': days,
+            'avg_daily_spend': spent / days if days > 0 else None,
+        })
+
+class MonthlyUsageAPI(ReadReplicaMixin, APIView):
     """API endpoint to get monthly usage for a specific year/month"""
     def get(self, request, year=None, month=None):
         if year is None or month is None:
@@ -125,6 +430,10 @@ class MonthlyUsageAPI(APIView):
             ).aggregate(
                 total=Sum('hourly_usage')
             )['total'] or 0.0
+            total += DailyUsageRollup.objects.filter(
+                date__gte=start_date.date(),
+                date__lt=end_date.date()
+            ).aggregate(total=Sum('total_usage'))['total'] or 0.0
             
             # Get daily breakdown
             daily_data = BalanceEntry.objects.filter(
@@ -135,9 +444,10 @@ class MonthlyUsageAPI(APIView):
             ).values('date').annotate(
                 daily_usage=Sum('hourly_usage')
             ).order_by('date')
+            daily_data = merge_daily_rollups(daily_data, start_date, end_date, usage_key='daily_usage')
             
             # Calculate number of days with data
-            days_with_data = daily_data.count()
+            days_with_data = len(daily_data)
             
             # Calculate average daily usage
             avg_daily_usage = total / days_with_data if days_with_data > 0 else 0
@@ -148,7 +458,7 @@ class MonthlyUsageAPI(APIView):
                 'total_usage': total,
                 'avg_daily_usage': avg_daily_usage,
                 'days_with_data': days_with_data,
-                'daily_breakdown': list(daily_data)
+                'daily_breakdown': daily_data
             }
             
             return Response(result)
@@ -158,5 +468,5 @@ class MonthlyUsageAPI(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-class YearlyUsageAPI(APIView):
+class YearlyUsageAPI(ReadReplicaMixin, APIView):
     """API endpoint to get yearly usage summary"""
\ No newline at end of file
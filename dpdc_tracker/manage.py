@@ -3,9 +3,14 @@
 import os
 import sys
 
+# Cron commands that only fetch and store readings run with minimal settings
+FETCH_COMMANDS = ('fetch_balance', 'flush_spool')
+
 
 def main():
     """Run administrative tasks."""
+    if len(sys.argv) > 1 and sys.argv[1] in FETCH_COMMANDS:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dpdc_tracker.settings_fetch')
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dpdc_tracker.settings')
     try:
         from django.core.management import execute_from_command_line
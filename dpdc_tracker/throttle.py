@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import tempfile
+from contextlib import contextmanager
+
+logger = logging.getLogger('dpdc_api')
+
+# Defaults for the shared throughput governor (overridable through the environment)
+DEFAULT_MAX_RATE = 2.0        # requests per second when the upstream is healthy
+DEFAULT_MIN_RATE = 0.1        # floor the adaptive rate never drops below
+DEFAULT_BURST = 5             # bucket capacity
+DEFAULT_MAX_WAIT = 30.0       # seconds a caller waits for a token before giving up
+DEFAULT_FAILURE_THRESHOLD = 5 # consecutive upstream failures before the breaker opens
+DEFAULT_RESET_TIMEOUT = 60.0  # seconds the breaker stays open before probing again
+
+
+class FileStateStore:
+    """Shared state kept in a local JSON file guarded by an exclusive flock"""
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def transaction(self, key):
+        """Yield the mutable state dict for key and persist it on exit"""
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                try:
+                    data = json.loads(raw) if raw else {}
+                except ValueError:
+                    logger.warning(f"Discarding corrupt throttle state in {self.path}")
+                    data = {}
+                state = data.setdefault(key, {})
+                yield state
+                f.seek(0)
+                f.truncate()
+                json.dump(data, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RedisStateStore:
+    """Shared state kept in Redis so workers on several hosts share one budget"""
+    def __init__(self, url, prefix='dpdc:throttle:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    @contextmanager
+    def transaction(self, key):
+        """Yield the mutable state dict for key and persist it on exit"""
+        name = f"{self.prefix}{key}"
+        with self.client.lock(f"{name}:lock", timeout=5, blocking_timeout=5):
+            raw = self.client.get(name)
+            state = json.loads(raw) if raw else {}
+            yield state
+            self.client.set(name, json.dumps(state))
+
+
+class TokenBucket:
+    """
+    Token bucket shared through a state store.
+
+    The refill rate adapts to the upstream: it backs off multiplicatively when
+    the upstream signals rate limiting and creeps back up additively on
+    success, so throughput settles near the highest rate the upstream sustains.
+    """
+    def __init__(self, store, max_rate=DEFAULT_MAX_RATE, min_rate=DEFAULT_MIN_RATE,
+                 burst=DEFAULT_BURST, key='bucket'):
+        self.store = store
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.burst = burst
+        self.key = key
+
+    def _refill(self, state, now):
+        rate = state.get('rate', self.max_rate)
+        tokens = state.get('tokens', float(self.burst))
+        elapsed = max(0.0, now - state.get('updated', now))
+        state['tokens'] = min(float(self.burst), tokens + elapsed * rate)
+        state['rate'] = rate
+        state['updated'] = now
+
+    def try_acquire(self):
+        """Take a token if one is available, otherwise return the seconds to wait"""
+        with self.store.transaction(self.key) as state:
+            now = time.time()
+            self._refill(state, now)
+            blocked_until = state.get('blocked_until', 0)
+            if blocked_until > now:
+                return blocked_until - now
+            if state['tokens'] >= 1:
+                state['tokens'] -= 1
+                return 0
+            return (1 - state['tokens']) / state['rate']
+
+    def acquire(self, max_wait=DEFAULT_MAX_WAIT):
+        """Block until a token is available; return False if that takes longer than max_wait"""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def on_success(self):
+        """Additively raise the rate after a request the upstream accepted"""
+        with self.store.transaction(self.key) as state:
+            rate = state.get('rate', self.max_rate)
+            state['rate'] = min(self.max_rate, rate + self.max_rate / 20)
+
+    def on_throttled(self, retry_after=None):
+        """Halve the rate and drain the bucket after the upstream pushed back"""
+        with self.store.transaction(self.key) as state:
+            now = time.time()
+            self._refill(state, now)
+            state['rate'] = max(self.min_rate, state['rate'] / 2)
+            state['tokens'] = 0.0
+            if retry_after:
+                state['blocked_until'] = max(state.get('blocked_until', 0), now + retry_after)
+            logger.warning(f"Upstream throttled us - request rate lowered to {state['rate']:.2f}/s")
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared through a state store.
+
+    Only upstream failures (rate limiting, 5xx, network errors) count towards
+    opening the circuit. Authentication failures mean the upstream is healthy
+    and are left to the caller's token refresh logic.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, store, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT, key='breaker'):
+        self.store = store
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.key = key
+
+    def allow_request(self):
+        """Return True if a request may be sent to the upstream right now"""
+        with self.store.transaction(self.key) as state:
+            now = time.time()
+            current = state.get('state', self.CLOSED)
+            if current == self.CLOSED:
+                return True
+            # Let a single probe through once the reset timeout has elapsed
+            if now - state.get('opened_at', 0) >= self.reset_timeout:
+                state['state'] = self.HALF_OPEN
+                state['opened_at'] = now
+                logger.info("Circuit breaker half-open - probing upstream")
+                return True
+            return False
+
+    def record_success(self):
+        with self.store.transaction(self.key) as state:
+            if state.get('state', self.CLOSED) != self.CLOSED:
+                logger.info("Circuit breaker closed - upstream recovered")
+            state['state'] = self.CLOSED
+            state['failures'] = 0
+
+    def record_failure(self):
+        with self.store.transaction(self.key) as state:
+            failures = state.get('failures', 0) + 1
+            state['failures'] = failures
+            if state.get('state') == self.HALF_OPEN or failures >= self.failure_threshold:
+                if state.get('state') != self.OPEN:
+                    logger.warning(f"Circuit breaker opened after {failures} upstream failures")
+                state['state'] = self.OPEN
+                state['opened_at'] = time.time()
+
+
+_store = None
+
+def get_state_store():
+    """Return the process-wide state store configured through the environment"""
+    global _store
+    if _store is None:
+        redis_url = os.getenv('DPDC_THROTTLE_REDIS_URL')
+        if redis_url:
+            _store = RedisStateStore(redis_url)
+        else:
+            path = os.getenv('DPDC_THROTTLE_STATE_PATH',
+                             os.path.join(tempfile.gettempdir(), 'dpdc_throttle.json'))
+            _store = FileStateStore(path)
+    return _store
+
+def get_rate_limiter():
+    """Build the shared token bucket from environment settings"""
+    return TokenBucket(
+        get_state_store(),
+        max_rate=float(os.getenv('DPDC_RATE_LIMIT', DEFAULT_MAX_RATE)),
+        min_rate=float(os.getenv('DPDC_RATE_MIN', DEFAULT_MIN_RATE)),
+        burst=int(os.getenv('DPDC_RATE_BURST', DEFAULT_BURST)),
+    )
+
+def get_circuit_breaker():
+    """Build the shared circuit breaker from environment settings"""
+    return CircuitBreaker(
+        get_state_store(),
+        failure_threshold=int(os.getenv('DPDC_BREAKER_THRESHOLD', DEFAULT_FAILURE_THRESHOLD)),
+        reset_timeout=float(os.getenv('DPDC_BREAKER_RESET', DEFAULT_RESET_TIMEOUT)),
+    )